@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from indexing.result_cache import normalize_query
+
+
+def document_ids(documents: list) -> list:
+    """
+    Versioned chunk ids of retrieved documents in rank order: the chunk id plus a hash of
+    the chunk text. A rebuild or incremental update that reuses an id for different text
+    changes the id, so answers built from the old text are not served.
+    """
+    ids = []
+    for doc in documents:
+        source = doc.get("_source", doc)
+        text = f"{source.get('book_id') or source.get('url') or source.get('name')}\n{source.get('summary_chunk', '')}"
+        text_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        ids.append(f"{doc['_id']}@{text_hash[:16]}" if "_id" in doc else text_hash)
+    return ids
+
+
+class AnswerCache:
+    """
+    Persistent cache of generated answers in a SQLite file.
+    An answer is keyed on everything that decides it: generator model, prompt template
+    version, normalized question and the ordered chunk ids and texts put into the prompt.
+    Entries expire ttl_seconds after they were written, and the least recently read
+    entries are evicted beyond max_entries. Safe to share between threads and processes.
+    """
+
+    def __init__(self, path: str, max_entries=10000, ttl_seconds=7 * 24 * 3600):
+        """
+        :param path: SQLite file, created if missing
+        :param ttl_seconds: None keeps answers until they are evicted
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")  # Readers do not block the writer
+            self.db.execute("CREATE TABLE IF NOT EXISTS answers ("
+                            "key TEXT PRIMARY KEY, answer TEXT NOT NULL, info TEXT, "
+                            "created_at REAL NOT NULL, used_at REAL NOT NULL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS answers_used_at ON answers (used_at)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS answers_created_at ON answers (created_at)")
+
+    @staticmethod
+    def key(model_name: str, template_version: str, query_text: str, chunk_ids: list) -> str:
+        payload = json.dumps({"model": model_name, "template": template_version,
+                              "query": normalize_query(query_text), "chunks": list(chunk_ids)})
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _expired_before(self):
+        return time.time() - self.ttl_seconds if self.ttl_seconds is not None else None
+
+    def get(self, key: str):
+        """Cached answer for key, or None."""
+        now = time.time()
+        expired_before = self._expired_before()
+        with self._lock, self.db:
+            row = self.db.execute("SELECT answer, created_at FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is not None and (expired_before is None or row[1] >= expired_before):
+                self.db.execute("UPDATE answers SET used_at = ? WHERE key = ?", (now, key))
+                self.hits += 1
+                return row[0]
+            if row is not None:
+                self.db.execute("DELETE FROM answers WHERE key = ?", (key,))
+            self.misses += 1
+            return None
+
+    def put(self, key: str, answer: str, info: dict = None):
+        """
+        Store an answer, then drop expired entries and evict beyond max_entries.
+        :param info: readable context kept next to the answer, e.g. model and question
+        """
+        now = time.time()
+        expired_before = self._expired_before()
+        with self._lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO answers (key, answer, info, created_at, used_at) "
+                            "VALUES (?, ?, ?, ?, ?)", (key, answer, json.dumps(info or {}), now, now))
+            if expired_before is not None:
+                self.db.execute("DELETE FROM answers WHERE created_at < ?", (expired_before,))
+            if self.max_entries is not None:
+                self.db.execute("DELETE FROM answers WHERE key IN ("
+                                "SELECT key FROM answers ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                                (self.max_entries,))
+
+    def invalidate(self):
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM answers")
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self.db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+            }
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.exceptions import NotFoundError
+
+from indexing.search import ElasticsearchRetriever, BOOK_SOURCE_FIELDS
+from indexing.elasticsearch_idx import books_index_name
+
+
+class AsyncElasticsearchRetriever(ElasticsearchRetriever):
+    """
+    asyncio version of ElasticsearchRetriever.
+    Searches go through a pooled AsyncElasticsearch client, and query embedding runs
+    in a thread pool so the event loop never blocks on the model.
+    Query building, filters, quantization and layouts are shared with the sync retriever.
+    """
+
+    def __init__(self, es_host='localhost', es_port=9200, es_scheme='http', connections_per_node=32,
+                 request_timeout=10, embedding_threads=2, **kwargs):
+        """
+        :param connections_per_node: HTTP connections kept open per ES node, caps in-flight requests
+        :param embedding_threads: threads running query embeddings; torch already parallelizes
+                                  each forward pass, so a few are enough
+        :param kwargs: passed on to ElasticsearchRetriever (model_name, layout, vector_storage, ...)
+        """
+        es_client = AsyncElasticsearch(
+            [{'host': es_host, 'port': es_port, 'scheme': es_scheme}],
+            connections_per_node=connections_per_node,
+            request_timeout=request_timeout,
+            retry_on_timeout=True,
+            max_retries=2,
+        )
+        super().__init__(es_host, es_port, es_scheme, es_client=es_client, **kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=embedding_threads, thread_name_prefix="query-embedding")
+
+    async def embed(self, text: str):
+        if self.query_batcher is not None:
+            self.check_query_batcher()
+            return await self.query_batcher.embed_async(text)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.get_embedding, text)
+
+    async def embed_many(self, texts: list):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.get_embeddings, texts)
+
+    async def vector_search(self, query_text: str, index_name: str, semantic=True, top_k=5, filters=None,
+                            num_candidates=None) -> list:
+        """Async vector_search, same arguments, result and caching as the sync retriever."""
+        if self.result_cache is None:
+            hits = await self.search_hits(query_text, index_name, semantic, top_k, filters, num_candidates)
+            return [hit["_source"] for hit in hits]
+
+        version = await self.index_version(index_name)
+        params = self.cache_params(version, index_name, semantic, top_k, filters, num_candidates)
+        documents = self.result_cache.get_exact(query_text, params)
+        if documents is not None:
+            return documents
+        query_embedding = await self.embed(query_text)
+        documents = self.result_cache.get_semantic(query_embedding, params)
+        if documents is not None:
+            return documents
+
+        hits = await self.search_hits(query_text, index_name, semantic, top_k, filters, num_candidates, query_embedding)
+        documents = [hit["_source"] for hit in hits]
+        self.result_cache.put(query_text, query_embedding, params, documents)
+        return documents
+
+    async def index_version(self, index_name: str) -> str:
+        cached = self._index_versions.get(index_name)
+        if cached is not None and time.monotonic() - cached[1] < self.version_check_seconds:
+            return cached[0]
+        try:
+            version = ",".join(sorted((await self.es.indices.get_alias(name=index_name)).keys()))
+        except NotFoundError:
+            version = index_name  # A concrete index, not an alias
+        self._index_versions[index_name] = (version, time.monotonic())
+        return version
+
+    async def search_hits(self, query_text: str, index_name: str, semantic=True, top_k=5, filters=None,
+                          num_candidates=None, query_embedding=None) -> list:
+        if query_embedding is None:
+            query_embedding = await self.embed(query_text)
+        body = self.build_query(self.query_vector(query_embedding), semantic, top_k, filters, num_candidates)
+        response = await self.es.search(index=index_name, body=body)
+        hits = response["hits"]["hits"]
+        if self.layout == "compact":
+            await self.join_books(hits, index_name)
+        return hits
+
+    async def vector_search_many(self, queries: list, index_name: str, semantic=True, top_k=5, filters=None,
+                                 num_candidates=None) -> list:
+        """
+        Search several queries at once: one batched embedding pass and one msearch request.
+        :return: one list of documents per query, [] for a query whose search failed
+        """
+        if not queries:
+            return []
+        query_embeddings = await self.embed_many(queries)
+
+        searches = []
+        for query_embedding in query_embeddings:
+            searches.append({"index": index_name})
+            searches.append(self.build_query(self.query_vector(query_embedding), semantic, top_k, filters,
+                                             num_candidates))
+        response = await self.es.msearch(searches=searches)
+
+        results = []
+        for query, result in zip(queries, response["responses"]):
+            if "error" in result:
+                logging.error(f"Search failed for query '{query}': {result['error']}")
+                results.append([])
+            else:
+                results.append(result["hits"]["hits"])
+
+        if self.layout == "compact":
+            # One mget for the books of every query
+            await self.join_books([hit for hits in results for hit in hits], index_name)
+        return [[hit["_source"] for hit in hits] for hits in results]
+
+    async def join_books(self, hits: list, index_name: str):
+        book_ids = self.hit_book_ids(hits)
+        if not book_ids:
+            return
+        response = await self.es.mget(index=books_index_name(index_name), ids=book_ids,
+                                      source_includes=BOOK_SOURCE_FIELDS)
+        self.merge_books(hits, response)
+
+    async def close(self):
+        await self.es.close()
+        self.executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+
+    async def main():
+        search = AsyncElasticsearchRetriever()
+        queries = [
+            "Find me books that have a summary like a murder mystery in a small town. The protagonist must be female.",
+            "An epic fantasy about a young farm boy who discovers he is the heir to a lost kingdom",
+        ]
+        try:
+            for query, docs in zip(queries, await search.vector_search_many(queries, 'goodreads', top_k=5)):
+                print(f"{query}\n    {[doc.get('name') for doc in docs]}")
+        finally:
+            await search.close()
+
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+import sys
+import os
+import time
+
+import torch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from indexing.embedding import EmbeddingModel, DEFAULT_MODEL_NAME
+
+
+SAMPLE_TEXTS = [
+    "Find me books that have a summary like a murder mystery in a small town.",
+    "An expansive fantasy with dragons, exiled heirs and a war for the throne.",
+    "A memoir about growing up on a farm during the depression.",
+    "Space opera following a smuggler crew who stumble on an alien artifact",
+    "Short",
+    "A cozy romance set in a seaside bakery where two rivals fall for each other over one long summer.",
+]
+
+
+def time_single_queries(model: EmbeddingModel, texts, repeats=5) -> float:
+    """Median latency in ms of embedding one query, the retriever's hot path."""
+    timings = []
+    for _ in range(repeats):
+        for text in texts:
+            start = time.perf_counter()
+            model.get_embedding(text)
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def check_parity(model_name=DEFAULT_MODEL_NAME, backends=("int8", "onnx"), texts=SAMPLE_TEXTS) -> dict:
+    """
+    Compare each backend against the fp32 eager reference.
+    Drift is 1 - cosine similarity per text; latency is the median single-query time.
+    """
+    reference = EmbeddingModel(model_name, backend="eager")
+    reference_vectors = reference.get_embeddings(texts)
+    report = {"eager": {"latency_ms": time_single_queries(reference, texts),
+                        "mean_drift": 0.0, "max_drift": 0.0}}
+
+    for backend in backends:
+        candidate = EmbeddingModel(model_name, backend=backend)
+        if candidate.backend != backend:
+            report[backend] = {"error": "backend failed to load, see log"}
+            continue
+        vectors = candidate.get_embeddings(texts)
+        drift = 1 - torch.nn.functional.cosine_similarity(reference_vectors, vectors, dim=1)
+        report[backend] = {
+            "latency_ms": time_single_queries(candidate, texts),
+            "mean_drift": drift.mean().item(),
+            "max_drift": drift.max().item(),
+        }
+    return report
+
+
+if __name__ == "__main__":
+
+    for backend, result in check_parity().items():
+        print(f"{backend}: {result}")
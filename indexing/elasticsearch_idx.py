@@ -1,39 +1,209 @@
 
 from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import NotFoundError
 import torch
 import logging
+import time
+
+from indexing.embedding import EMBEDDING_DIM
+
+
+VECTOR_STORAGES = ("float", "int8_hnsw", "byte")
+LAYOUTS = ("full", "compact")
+
+# Small fields the retriever filters on; kept on every chunk in both layouts
+FILTER_PROPERTIES = {
+    "star_rating": {"type": "float", "ignore_malformed": True},
+    "genres": {"type": "keyword"},
+    "first_published": {"type": "date", "ignore_malformed": True,
+                        "format": "strict_date_optional_time||MMMM d, yyyy||M/d/yyyy||yyyy"},
+    "kindle_price": {"type": "float", "ignore_malformed": True},
+}
+# Per-book metadata; copied into every chunk in the full layout, stored once in the compact one
+BOOK_PROPERTIES = {
+    "url": {"type": "keyword"},
+    "name": {"type": "text", "fields": {"keyword": {"type": "keyword", "ignore_above": 256}}},
+    "author": {"type": "text", "fields": {"keyword": {"type": "keyword", "ignore_above": 256}}},
+    "num_ratings": {"type": "long", "ignore_malformed": True},
+    "num_reviews": {"type": "long", "ignore_malformed": True},
+    "about_author": {"type": "object", "enabled": False},  # Returned with hits, never searched
+    "community_reviews": {"type": "object", "enabled": False},
+}
+
+
+def books_index_name(index_name: str) -> str:
+    """Index (or alias) holding book metadata for a compact-layout chunk index."""
+    return f"{index_name}_books"
+
+
+def embedding_mapping(similarity="cosine", m=16, ef_construction=100, vector_storage="float") -> dict:
+    """
+    dense_vector mapping for the chunk embedding.
+    :param vector_storage: "float" stores and graphs float32;
+                           "int8_hnsw" keeps float input but builds the HNSW graph on int8, ~4x less memory;
+                           "byte" stores int8 vectors (see quantize_int8), which also makes bulk payloads ~4x smaller
+    """
+    if vector_storage not in VECTOR_STORAGES:
+        raise ValueError(f"Unknown vector storage {vector_storage}, expected one of {VECTOR_STORAGES}")
+    index_type = "int8_hnsw" if vector_storage == "int8_hnsw" else "hnsw"
+    mapping = {
+        "type": "dense_vector",
+        "dims": EMBEDDING_DIM,
+        "index": True,
+        "similarity": similarity,
+        "index_options": {"type": index_type, "m": m, "ef_construction": ef_construction},
+    }
+    if vector_storage == "byte":
+        mapping["element_type"] = "byte"
+    return mapping
+
+
+def goodreads_mapping(similarity="cosine", m=16, ef_construction=100, vector_storage="float", layout="full") -> dict:
+    """
+    Mapping for the chunk documents GoodreadsIndexer writes.
+    The embedding is an explicit HNSW dense_vector; m and ef_construction trade
+    graph size and build time against recall.
+    :param layout: "full" copies book metadata into every chunk; "compact" chunks carry
+                   only book_id, text, filter fields and the vector (see book_mapping)
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout {layout}, expected one of {LAYOUTS}")
+    properties = {
+        "summary_chunk": {"type": "text"},
+        "content_hash": {"type": "keyword"},
+        "chunk_count": {"type": "integer"},
+        "embedding": embedding_mapping(similarity, m, ef_construction, vector_storage),
+        **FILTER_PROPERTIES,
+    }
+    if layout == "full":
+        properties.update(BOOK_PROPERTIES)
+    else:
+        properties["book_id"] = {"type": "keyword"}
+    return {"properties": properties}
+
+
+def book_mapping() -> dict:
+    """Mapping of the one-document-per-book metadata index used by the compact layout."""
+    return {"properties": {**BOOK_PROPERTIES, **FILTER_PROPERTIES}}
+
 
 class ElasticsearchVectorStore:
     """Handles storing and searching embeddings in Elasticsearch."""
 
-    def __init__(self, es_host: str, index_name: str):
-        """Initialize Elasticsearch client and ensure index is created."""
-        self.es = Elasticsearch(es_host, verify_certs=False)
+    def __init__(self, es_host: str, index_name: str, es_client=None, create=True, layout="full"):
+        """
+        Initialize Elasticsearch client and ensure index is created.
+        :param es_client: reuse an existing client instead of connecting to es_host
+        :param create: False skips creating index_name, e.g. when it is an alias managed by bulk loads
+        :param layout: "compact" also manages the books index next to the chunk index
+        """
+        self.es = es_client if es_client is not None else Elasticsearch(es_host, verify_certs=False)
         self.index_name = index_name
-        self.create_index()  # Ensure index exists on startup
+        self.layout = layout
+        if create:
+            self.create_index()  # Ensure index exists on startup
 
     def create_index(self):
         """Creates an Elasticsearch index if it does not exist."""
-        mapping = {
-            "mappings": {
-                "properties": {
-                    "book_id": {"type": "keyword"},
-                    "title": {"type": "text"},
-                    "description": {"type": "text"},
-                    "genre": {"type": "keyword"},
-                    "rating": {"type": "float"},
-                    "num_reviews": {"type": "integer"},
-                    "embedding": {"type": "dense_vector", "dims": 384}  
-                }
-            }
-        }
-        if not self.es.indices.exists(index=self.index_name):
-            self.es.indices.create(index=self.index_name, body=mapping)
-            print(f"Index '{self.index_name}' created.")
-        else:
-            print(f"Index '{self.index_name}' already exists.")
+        indices = {self.index_name: goodreads_mapping(layout=self.layout)}
+        if self.layout == "compact":
+            indices[books_index_name(self.index_name)] = book_mapping()
+        for index_name, mapping in indices.items():
+            if not self.es.indices.exists(index=index_name):
+                self.es.indices.create(index=index_name, mappings=mapping)
+                print(f"Index '{index_name}' created.")
+            else:
+                print(f"Index '{index_name}' already exists.")
+
+    def begin_bulk_load(self, similarity="cosine", m=16, ef_construction=100, vector_storage="float") -> str:
+        """
+        Create a new versioned index behind the alias self.index_name, tuned for a full load:
+        no refreshes and no replicas until finish_bulk_load.
+        :return: name of the new index to write into
+        """
+        versioned_index = f"{self.index_name}_v{time.strftime('%Y%m%d%H%M%S')}"
+        load_settings = {"refresh_interval": "-1", "number_of_replicas": 0}
+        self.es.indices.create(
+            index=versioned_index,
+            mappings=goodreads_mapping(similarity, m, ef_construction, vector_storage, self.layout),
+            settings=load_settings,
+        )
+        print(f"Index '{versioned_index}' created for bulk load.")
+        if self.layout == "compact":
+            self.es.indices.create(index=books_index_name(versioned_index), mappings=book_mapping(),
+                                   settings=load_settings)
+            print(f"Index '{books_index_name(versioned_index)}' created for bulk load.")
+        return versioned_index
+
+    def finish_bulk_load(self, versioned_index: str, replicas=1, refresh_interval="1s", delete_old=False):
+        """
+        Force-merge the loaded index, restore live settings and atomically point the alias at it.
+        :param delete_old: delete the indices the alias pointed to before
+        """
+        # alias -> new index, both swapped in the same atomic update
+        swaps = {self.index_name: versioned_index}
+        if self.layout == "compact":
+            swaps[books_index_name(self.index_name)] = books_index_name(versioned_index)
+
+        for new_index in swaps.values():
+            print(f"Force merging '{new_index}'...")
+            # Merging to one segment leaves one HNSW graph per shard, the fastest layout to search
+            self.es.options(request_timeout=3600).indices.forcemerge(index=new_index, max_num_segments=1)
+            self.es.indices.put_settings(index=new_index, settings={
+                "refresh_interval": refresh_interval,
+                "number_of_replicas": replicas,
+            })
+            self.es.indices.refresh(index=new_index)
+            self.es.options(request_timeout=600).cluster.health(index=new_index, wait_for_status="yellow")
+
+        old_indices = self.swap_aliases(swaps)
+        if delete_old:
+            for old_index in old_indices:
+                self.es.indices.delete(index=old_index, ignore_unavailable=True)
+                print(f"Index '{old_index}' deleted.")
+        elif old_indices:
+            print(f"Previous indices kept: {old_indices}")
+
+    def abort_bulk_load(self, versioned_index: str):
+        """Delete a versioned index from begin_bulk_load that will not be swapped in."""
+        indices = [versioned_index]
+        if self.layout == "compact":
+            indices.append(books_index_name(versioned_index))
+        for index in indices:
+            self.es.indices.delete(index=index, ignore_unavailable=True)
+            print(f"Index '{index}' deleted.")
+
+    def swap_alias(self, new_index: str) -> list:
+        """Point the alias self.index_name at new_index, see swap_aliases."""
+        return self.swap_aliases({self.index_name: new_index})
 
+    def swap_aliases(self, swaps: dict) -> list:
+        """
+        Point every alias in swaps at its new index in one atomic update.
+        A concrete index that still has an alias's name is removed in the same update.
+        :param swaps: alias -> new index
+        :return: indices the aliases pointed to before
+        """
+        actions = []
+        replaced = []
+        for alias, new_index in swaps.items():
+            old_indices = []
+            try:
+                old_indices = list(self.es.indices.get_alias(name=alias).keys())
+            except NotFoundError:
+                if self.es.indices.exists(index=alias):
+                    print(f"'{alias}' is a concrete index, replacing it with an alias.")
+                    actions.append({"remove_index": {"index": alias}})
+            for old_index in old_indices:
+                if old_index != new_index:
+                    actions.append({"remove": {"index": old_index, "alias": alias}})
+                    replaced.append(old_index)
+            actions.append({"add": {"index": new_index, "alias": alias, "is_write_index": True}})
 
+        self.es.indices.update_aliases(actions=actions)
+        for alias, new_index in swaps.items():
+            print(f"Alias '{alias}' now points to '{new_index}'.")
+        return replaced
 
     def insert_document(self, book_id: str, title: str, description: str, genre: list, rating: float, num_reviews: int, embedding: list):
         """Insert a book document into Elasticsearch with metadata and vector embedding."""
@@ -1,38 +1,205 @@
 #%%
 from transformers import AutoTokenizer, AutoModel
+import numpy as np
 import torch
 import logging
+import os
+
+
+DEFAULT_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384  # all-MiniLM-L6-v2 output size; the ES mapping expects this
+
+BACKENDS = ("eager", "int8", "onnx")
+DEFAULT_BACKEND = os.getenv("EMBEDDING_BACKEND", "eager")  # Selects the inference backend per deployment
+ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", os.path.join(os.path.expanduser("~"), ".cache", "document-llm", "onnx"))
 
 
 class EmbeddingModel:
-    def __init__(self, model_name="sentence-transformers/all-MiniLM-L6-v2"):
+    def __init__(self, model_name=DEFAULT_MODEL_NAME, backend=DEFAULT_BACKEND):
+        """
+        :param backend: "eager" fp32 PyTorch, "int8" dynamically quantized Linear layers,
+                        or "onnx" for an exported ONNX Runtime graph. A backend that fails
+                        to load falls back to eager.
+        """
+        self.model_name = model_name
+        self.backend = "eager"
+        self.onnx_session = None
         try:
             self.tokenizer = AutoTokenizer.from_pretrained(model_name) #auto loads the tokenizer for the model
             self.model = AutoModel.from_pretrained(model_name) #loads the pretrained model for specific function
+            self.model.eval() #disable dropout, inference only
         except Exception as e:
             logging.error(f"Error loading model {model_name}: {e}")
             self.tokenizer = None
             self.model = None
+            return
+
+        if backend not in BACKENDS:
+            logging.error(f"Unknown embedding backend {backend}, expected one of {BACKENDS}")
+        elif backend != "eager":
+            try:
+                if backend == "int8":
+                    self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+                else:
+                    self.load_onnx()
+                self.backend = backend
+            except Exception as e:
+                logging.error(f"Error loading {backend} backend for {model_name}, using eager: {e}")
+
+    def onnx_path(self) -> str:
+        return os.path.join(ONNX_DIR, self.model_name.replace("/", "__") + ".onnx")
+
+    def load_onnx(self):
+        """
+        Export the model to ONNX once, then run it through an ONNX Runtime CPU session.
+        The graph is checked against the eager model on every load, and deleted if the
+        outputs differ, so a bad export is never cached and reused.
+        """
+        import onnxruntime as ort  # Optional dependency, only needed for this backend
+
+        path = self.onnx_path()
+        exported = not os.path.exists(path)
+        dummy = self.tokenizer(["export the embedding model", "a second, longer text so the batch is padded"],
+                               padding=True, return_tensors="pt")
+        # Positional inputs in forward() signature order, named the same way
+        input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+        if exported:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+            with torch.no_grad():  # inference_mode tensors cannot be traced
+                torch.onnx.export(self.model, tuple(dummy[name] for name in input_names), path,
+                                  input_names=input_names, output_names=["last_hidden_state"],
+                                  dynamic_axes=dynamic_axes, opset_version=14)
+            print(f"Exported {self.model_name} to {path}")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.onnx_session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.onnx_input_names = [node.name for node in self.onnx_session.get_inputs()]
+
+        with torch.no_grad():
+            expected = self.mean_pool(self.model(**dummy).last_hidden_state, dummy["attention_mask"])
+            actual = self.mean_pool(self.forward(dummy), dummy["attention_mask"])
+        if not torch.allclose(expected, actual, atol=1e-4):
+            self.onnx_session = None
+            os.remove(path)
+            raise RuntimeError(f"ONNX export of {self.model_name} does not match the eager model "
+                               f"(max difference {(expected - actual).abs().max().item():.2e})")
+
+    def forward(self, inputs) -> torch.Tensor:
+        """Last hidden state for a padded batch, from whichever backend is active."""
+        if self.onnx_session is not None:
+            feeds = {name: inputs[name].numpy() for name in self.onnx_input_names}
+            return torch.from_numpy(self.onnx_session.run(["last_hidden_state"], feeds)[0])
+        return self.model(**inputs).last_hidden_state
 
     def get_embedding(self, text: str) -> torch.Tensor:
         """Generate embedding for a single text."""
         if self.tokenizer and self.model:
-            try:
-                inputs = self.tokenizer(text, return_tensors="pt", truncation=True, padding=True)
-                outputs = self.model(**inputs)
-                embedding = outputs.last_hidden_state.mean(dim=1).squeeze()
-                
-                # Ensure the embedding has 384 dimensions, resize if necessary
-                if embedding.size(0) != 384:
-                    embedding = torch.zeros(384)  #Resize to 384 if not 384 dimensions; ES required 384
-                
-                return embedding
-            except Exception as e:
-                logging.error(f"Error generating embedding: {e}")
-                return torch.zeros(384)  # Return a 384-dimensional zero vector
+            embedding = self.get_embeddings([text])[0]
+
+            # Ensure the embedding has 384 dimensions, resize if necessary
+            if embedding.size(0) != EMBEDDING_DIM:
+                embedding = torch.zeros(EMBEDDING_DIM)  #Resize to 384 if not 384 dimensions; ES required 384
+
+            return embedding
         else:
             logging.error("Model or tokenizer not loaded correctly.")
-            return torch.zeros(384)  # Return a 384-dimensional zero vector
-            
+            return torch.zeros(EMBEDDING_DIM)  # Return a 384-dimensional zero vector
+
+    def get_embeddings(self, texts: list[str], batch_size: int = 32, cache=None) -> torch.Tensor:
+        """
+        Generate embeddings for many texts with batched forward passes.
+        Texts are sorted by token length so each batch is padded only up to its own
+        longest text; rows come back in the input order.
+        :param cache: optional EmbeddingCache; only texts missing from it are run through the model
+        :return: contiguous (len(texts), 384) float tensor, zero rows on failure
+        """
+        if cache is not None:
+            return self.get_embeddings_cached(texts, batch_size, cache)
+
+        embeddings = torch.zeros(len(texts), EMBEDDING_DIM)
+        if not texts:
+            return embeddings
+        if not (self.tokenizer and self.model):
+            logging.error("Model or tokenizer not loaded correctly.")
+            return embeddings
+
+        try:
+            # Tokenize once without padding, padding is applied per batch below
+            encoded = self.tokenizer(list(texts), truncation=True)
+            lengths = [len(ids) for ids in encoded["input_ids"]]
+            order = sorted(range(len(texts)), key=lambda i: lengths[i])
+
+            with torch.inference_mode():
+                for start in range(0, len(order), batch_size):
+                    batch_idx = order[start:start + batch_size]
+                    features = [{key: encoded[key][i] for key in encoded.keys()} for i in batch_idx]
+                    inputs = self.tokenizer.pad(features, return_tensors="pt")
+                    pooled = self.mean_pool(self.forward(inputs), inputs["attention_mask"])
+                    if pooled.size(1) != EMBEDDING_DIM:
+                        logging.error(f"Model {self.model_name} returned {pooled.size(1)} dims, expected {EMBEDDING_DIM}")
+                        return torch.zeros(len(texts), EMBEDDING_DIM)
+                    embeddings[batch_idx] = pooled
+        except Exception as e:
+            logging.error(f"Error generating embeddings: {e}")
+            return torch.zeros(len(texts), EMBEDDING_DIM)
+
+        return embeddings.contiguous()
+
+    def get_embeddings_cached(self, texts: list[str], batch_size: int, cache) -> torch.Tensor:
+        """get_embeddings backed by an EmbeddingCache; new vectors are written back to it."""
+        return embed_with_cache(lambda misses: self.get_embeddings(misses, batch_size), texts, cache)
+
+    @staticmethod
+    def mean_pool(last_hidden_state: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        """Average token vectors over real tokens only, so padding does not shift the result."""
+        mask = attention_mask.unsqueeze(-1).to(last_hidden_state.dtype)
+        summed = (last_hidden_state * mask).sum(dim=1)
+        counts = mask.sum(dim=1).clamp(min=1e-9)
+        return summed / counts
+
+
+def quantize_int8_array(vectors: np.ndarray) -> np.ndarray:
+    """
+    Scale each vector so its largest component is +-127 and round to int8.
+    Cosine similarity is scale invariant, so only rounding error is lost.
+    Works on a single vector or an (n, dim) matrix.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    matrix = vectors.reshape(1, -1) if vectors.ndim == 1 else vectors
+    scale = 127.0 / np.maximum(np.abs(matrix).max(axis=1, keepdims=True), 1e-12)
+    quantized = np.clip(np.round(matrix * scale), -127, 127).astype(np.int8)
+    return quantized[0] if vectors.ndim == 1 else quantized
+
+
+def quantize_int8(embeddings: torch.Tensor) -> torch.Tensor:
+    """quantize_int8_array for tensors, the result stays on the input's device."""
+    quantized = quantize_int8_array(embeddings.detach().float().cpu().numpy())
+    return torch.from_numpy(quantized).to(embeddings.device)
+
+
+def embed_with_cache(embed_fn, texts: list[str], cache) -> torch.Tensor:
+    """
+    Serve texts from cache where possible and run only the misses through embed_fn.
+    :param embed_fn: callable mapping a list of texts to an (n, 384) tensor
+    """
+    keys = [cache.key(text) for text in texts]
+    cached = cache.get(keys)
+    embeddings = torch.zeros(len(texts), EMBEDDING_DIM)
+
+    hit_idx = [i for i, vector in enumerate(cached) if vector is not None]
+    if hit_idx:
+        embeddings[hit_idx] = torch.from_numpy(np.stack([cached[i] for i in hit_idx]))
+
+    miss_idx = [i for i, vector in enumerate(cached) if vector is None]
+    if miss_idx:
+        computed = embed_fn([texts[i] for i in miss_idx])
+        embeddings[miss_idx] = computed
+        valid = (computed.norm(dim=1) > 0).tolist()  # Never cache the zero vectors of failed batches
+        cache.put([keys[i] for i, ok in zip(miss_idx, valid) if ok], computed[valid].numpy())
+    return embeddings
+
 
 # %%
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from indexing.embedding import EMBEDDING_DIM
+
+
+KEY_BYTES = 20  # sha1 digest of the text
+
+
+class EmbeddingCache:
+    """
+    Content-addressed, on-disk cache of embedding vectors.
+    Each namespace (model name + preprocessing config + dtype) is an append-only vector
+    file read through np.memmap, plus a keys file holding the sha1 of each row's text
+    in the same order. Only the key index lives in RAM.
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, config: dict = None, dtype="float32",
+                 dim=EMBEDDING_DIM, max_entries=None):
+        """
+        :param config: preprocessing settings that change the text being embedded
+        :param dtype: "float32" or "float16" storage; float16 halves the file size
+        :param max_entries: evict least recently used vectors beyond this many rows
+        """
+        self.dtype = np.dtype(dtype)
+        self.dim = dim
+        self.row_bytes = self.dtype.itemsize * dim
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        namespace_info = {"model_name": model_name, "config": config or {}, "dtype": self.dtype.name, "dim": dim}
+        namespace = hashlib.sha1(json.dumps(namespace_info, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        os.makedirs(cache_dir, exist_ok=True)
+        self.vectors_path = os.path.join(cache_dir, f"{namespace}.vectors")
+        self.keys_path = os.path.join(cache_dir, f"{namespace}.keys")
+        with open(os.path.join(cache_dir, f"{namespace}.json"), "w") as f:
+            json.dump(namespace_info, f)  # Human readable description of the namespace
+
+        self._vectors = None  # np.memmap over the first _mapped_rows rows
+        self._mapped_rows = 0
+        self.index = OrderedDict()  # key -> row, least recently used first
+        self.load()
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        return hashlib.sha1(text.encode("utf-8")).digest()
+
+    def load(self):
+        """Read the key index, dropping a half-written tail left by a crash."""
+        keys = b""
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, "rb") as f:
+                keys = f.read()
+        num_keys = len(keys) // KEY_BYTES
+        num_vectors = os.path.getsize(self.vectors_path) // self.row_bytes if os.path.exists(self.vectors_path) else 0
+        rows = min(num_keys, num_vectors)
+        if rows != num_keys or rows != num_vectors or len(keys) % KEY_BYTES:
+            logging.warning(f"Embedding cache {self.vectors_path} has a partial tail, truncating to {rows} rows")
+            self._truncate(rows)
+
+        self.index = OrderedDict((keys[i * KEY_BYTES:(i + 1) * KEY_BYTES], i) for i in range(rows))
+        self._vectors = None
+        self._mapped_rows = 0
+
+    def _truncate(self, rows):
+        for path, row_size in ((self.keys_path, KEY_BYTES), (self.vectors_path, self.row_bytes)):
+            if os.path.exists(path):
+                with open(path, "r+b") as f:
+                    f.truncate(rows * row_size)
+
+    def _rows_on_disk(self):
+        return os.path.getsize(self.vectors_path) // self.row_bytes if os.path.exists(self.vectors_path) else 0
+
+    def _mapped(self):
+        """Memory map covering every row written so far, remapped after appends."""
+        rows = self._rows_on_disk()
+        if self._vectors is None or rows != self._mapped_rows:
+            self._vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(rows, self.dim)) if rows else None
+            self._mapped_rows = rows
+        return self._vectors
+
+    def get(self, keys) -> list:
+        """Cached float32 vector for each key, or None on a miss."""
+        with self._lock:
+            rows = [self.index.get(key) for key in keys]
+            found = [row for row in rows if row is not None]
+            vectors = self._mapped() if found else None
+            results = []
+            for key, row in zip(keys, rows):
+                if row is None:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    self.hits += 1
+                    self.index.move_to_end(key)
+                    results.append(np.asarray(vectors[row], dtype=np.float32))
+            return results
+
+    def put(self, keys, vectors):
+        """Append vectors for keys that are not cached yet."""
+        with self._lock:
+            new_keys, new_rows, seen = [], [], set()
+            for key, vector in zip(keys, vectors):
+                if key in self.index or key in seen:
+                    continue
+                seen.add(key)
+                new_keys.append(key)
+                new_rows.append(vector)
+            if not new_keys:
+                return
+
+            block = np.ascontiguousarray(np.stack(new_rows), dtype=self.dtype)
+            first_row = self._rows_on_disk()
+            # Vectors first, keys second: a crash in between leaves extra vectors that load() drops
+            with open(self.vectors_path, "ab") as f:
+                f.write(block.tobytes())
+            with open(self.keys_path, "ab") as f:
+                f.write(b"".join(new_keys))
+            for offset, key in enumerate(new_keys):
+                self.index[key] = first_row + offset
+
+            if self.max_entries is not None and len(self.index) > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        """Rewrite both files keeping the most recently used rows (90% of max_entries, to amortize rewrites)."""
+        keep = int(self.max_entries * 0.9)
+        kept = list(self.index.items())[-keep:] if keep else []
+        vectors = self._mapped()
+
+        tmp_vectors, tmp_keys = self.vectors_path + ".tmp", self.keys_path + ".tmp"
+        with open(tmp_vectors, "wb") as vf, open(tmp_keys, "wb") as kf:
+            for start in range(0, len(kept), 4096):
+                part = kept[start:start + 4096]
+                vf.write(np.ascontiguousarray(vectors[[row for _, row in part]]).tobytes())
+                kf.write(b"".join(key for key, _ in part))
+        self._vectors = None
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_keys, self.keys_path)
+
+        evicted = len(self.index) - len(kept)
+        self.index = OrderedDict((key, new_row) for new_row, (key, _) in enumerate(kept))
+        self._mapped_rows = 0
+        print(f"Embedding cache evicted {evicted} vectors, {len(self.index)} remain.")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.index),
+                "bytes": len(self.index) * (self.row_bytes + KEY_BYTES),
+            }
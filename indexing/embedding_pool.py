@@ -0,0 +1,129 @@
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import torch
+
+from indexing.embedding import DEFAULT_MODEL_NAME, DEFAULT_BACKEND, EMBEDDING_DIM, embed_with_cache
+from indexing.model_registry import get_embedding_model
+
+
+_worker_model = None  # EmbeddingModel of the current worker process
+
+
+def _init_worker(model_name, backend, num_threads):
+    """
+    Runs once in every worker: pin the torch thread budget and load the model.
+    A worker whose backend fell back to eager refuses to start, which breaks the pool,
+    so no worker embeds with another backend than the cache namespace says.
+    """
+    global _worker_model
+    torch.set_num_threads(num_threads)
+    _worker_model = get_embedding_model(model_name, backend)
+    if _worker_model.model is None or _worker_model.backend != backend:
+        raise RuntimeError(f"Embedding worker could not load the {backend} backend for {model_name}")
+
+
+def _worker_ready():
+    return os.getpid()
+
+
+def _embed_shard(shm_name, total_rows, start, texts, batch_size):
+    """
+    Embed one shard and write it into the shared output matrix at rows start:start+len(texts).
+    :return: (pid, rows, seconds)
+    """
+    started = time.perf_counter()
+    shm = SharedMemory(name=shm_name)
+    try:
+        output = np.ndarray((total_rows, EMBEDDING_DIM), dtype=np.float32, buffer=shm.buf)
+        output[start:start + len(texts)] = _worker_model.get_embeddings(texts, batch_size).numpy()
+        del output  # Release the buffer before closing the segment
+    finally:
+        shm.close()
+    return os.getpid(), len(texts), time.perf_counter() - started
+
+
+class EmbeddingWorkerPool:
+    """
+    Embeds texts across several processes, each with its own model and torch thread budget.
+    Has the same get_embeddings API as EmbeddingModel, so the indexer can use either.
+    Workers write vectors straight into a shared memory matrix; only texts and
+    small timing tuples are pickled.
+    """
+
+    def __init__(self, num_workers=None, threads_per_worker=None, model_name=DEFAULT_MODEL_NAME, batch_size=32,
+                 backend=DEFAULT_BACKEND):
+        cpu_count = os.cpu_count() or 1
+        self.num_workers = num_workers or cpu_count
+        self.threads_per_worker = threads_per_worker or max(1, cpu_count // self.num_workers)
+        self.model_name = model_name
+        self.backend = backend  # Every worker runs it, see _init_worker
+        self.batch_size = batch_size
+        self.worker_stats = {}  # pid -> {"rows": int, "seconds": float}
+
+        # spawn, not fork: a forked copy of an initialized torch runtime can deadlock
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_name, backend, self.threads_per_worker),
+        )
+        try:
+            self.executor.submit(_worker_ready).result()  # Surfaces a failed model or backend load now
+        except BrokenProcessPool:
+            self.executor.shutdown(wait=True)
+            raise RuntimeError(f"Embedding workers could not load {model_name} with the {backend} backend; "
+                               f"see the worker log, or choose another backend") from None
+        print(f"Started {self.num_workers} embedding workers with {self.threads_per_worker} threads each.")
+
+    def get_embeddings(self, texts: list[str], batch_size: int = None, cache=None) -> torch.Tensor:
+        """Embed texts across the pool; same contract as EmbeddingModel.get_embeddings."""
+        batch_size = batch_size or self.batch_size
+        if cache is not None:
+            return embed_with_cache(lambda misses: self.get_embeddings(misses, batch_size), texts, cache)
+
+        total = len(texts)
+        if total == 0:
+            return torch.zeros(0, EMBEDDING_DIM)
+
+        # Similar lengths end up in the same shard, which keeps per-batch padding low
+        order = sorted(range(total), key=lambda i: len(texts[i]))
+        sorted_texts = [texts[i] for i in order]
+        # A few shards per worker so a slow shard does not leave the others idle
+        shard_size = max(batch_size, math.ceil(total / (self.num_workers * 4)))
+
+        shm = SharedMemory(create=True, size=total * EMBEDDING_DIM * np.dtype(np.float32).itemsize)
+        try:
+            futures = [
+                self.executor.submit(_embed_shard, shm.name, total, start, sorted_texts[start:start + shard_size], batch_size)
+                for start in range(0, total, shard_size)
+            ]
+            for future in futures:
+                pid, rows, seconds = future.result()
+                stats = self.worker_stats.setdefault(pid, {"rows": 0, "seconds": 0.0})
+                stats["rows"] += rows
+                stats["seconds"] += seconds
+            sorted_vectors = np.ndarray((total, EMBEDDING_DIM), dtype=np.float32, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+
+        embeddings = torch.zeros(total, EMBEDDING_DIM)
+        embeddings[order] = torch.from_numpy(sorted_vectors)
+        return embeddings
+
+    def stats(self) -> dict:
+        """Embedded rows and rows/sec for every worker process."""
+        return {
+            pid: {**stats, "rows_per_sec": stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0}
+            for pid, stats in self.worker_stats.items()
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+
+from indexing.embedding import DEFAULT_MODEL_NAME, DEFAULT_BACKEND
+from indexing.local_store import LocalVectorStore
+from indexing.search import ElasticsearchRetriever
+
+
+class LocalVectorRetriever(ElasticsearchRetriever):
+    """
+    ElasticsearchRetriever over LocalVectorStore directories instead of an ES cluster.
+    index_name names a store under root_dir, so callers switch backends without other
+    changes. Embedding, micro-batching, result caching and filter validation are shared
+    with the ES retriever; a rebuilt store is picked up on the next version check.
+    """
+
+    def __init__(self, root_dir: str, model_name=DEFAULT_MODEL_NAME, embedding_backend=DEFAULT_BACKEND,
+                 num_candidates=100, nprobe=8, query_batcher=None, result_cache=None, version_check_seconds=30):
+        """
+        :param root_dir: directory holding one store per index name, see GoodreadsIndexer.build_local_store
+        :param num_candidates: HNSW candidate list size, as in ES kNN
+        :param nprobe: IVF lists scanned per query; more is slower but more accurate
+        """
+        # Stores quantize on their own, so queries stay float; metadata lives next to the vectors
+        super().__init__(model_name=model_name, embedding_backend=embedding_backend, num_candidates=num_candidates,
+                         vector_storage="float", layout="full", query_batcher=query_batcher,
+                         result_cache=result_cache, version_check_seconds=version_check_seconds)
+        self.root_dir = root_dir
+        self.nprobe = nprobe
+        self._index_versions = {}  # index name -> (store version, checked_at)
+        self._stores = {}  # index name -> open LocalVectorStore
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def connect(es_host, es_port, es_scheme):
+        return None  # No ES client
+
+    def index_version(self, index_name: str) -> str:
+        cached = self._index_versions.get(index_name)
+        if cached is not None and time.monotonic() - cached[1] < self.version_check_seconds:
+            return cached[0]
+        version = LocalVectorStore.read_version(os.path.join(self.root_dir, index_name))
+        if version is None:
+            raise FileNotFoundError(f"No local vector store '{index_name}' in {self.root_dir}")
+        self._index_versions[index_name] = (version, time.monotonic())
+        return version
+
+    def store(self, index_name: str) -> LocalVectorStore:
+        """Open store for index_name, reopened when a rebuild changed its version."""
+        version = self.index_version(index_name)
+        with self._lock:
+            store = self._stores.get(index_name)
+            if store is None or store.version != version:
+                store = LocalVectorStore(os.path.join(self.root_dir, index_name))
+                self._stores[index_name] = store
+            return store
+
+    def search_hits(self, query_text: str, index_name: str, semantic=True, top_k=5, filters=None,
+                    num_candidates=None, query_embedding=None) -> list:
+        """
+        Same hits as the ES retriever: _id, _score and _source, with _score on the ES scale,
+        (1 + cosine) / 2 like kNN for semantic=True and cosine + 1 like the exact script
+        otherwise. semantic=False, and any filter, scores candidates exactly.
+        """
+        self.build_filter_clauses(filters)  # Same validation as the ES retriever
+        if query_embedding is None:
+            query_embedding = self.get_embedding(query_text)
+        store = self.store(index_name)
+        rows, scores = store.search(query_embedding.cpu().detach().numpy(), top_k, filters, exact=not semantic,
+                                    nprobe=self.nprobe, ef=num_candidates or self.num_candidates)
+        scores = (1 + scores) / 2 if semantic else scores + 1
+        return [{"_index": index_name, "_id": doc["id"], "_score": float(score), "_source": doc}
+                for doc, score in zip(store.documents(rows), scores)]
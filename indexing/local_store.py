@@ -0,0 +1,367 @@
+import json
+import logging
+import math
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from indexing.embedding import EMBEDDING_DIM, DEFAULT_MODEL_NAME, quantize_int8_array
+
+
+VECTOR_DTYPES = ("float16", "int8")
+ANN_TYPES = ("ivf", "hnsw", "exact")
+BLOCK_ROWS = 65536  # Rows scored per matmul, bounds the float32 copy of a memmap slice
+
+# Columnar metadata of each chunk, the fields ElasticsearchRetriever returns plus what filters need
+METADATA_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("book_id", pa.string()),
+    ("summary_chunk", pa.string()),
+    ("url", pa.string()),
+    ("name", pa.string()),
+    ("author", pa.string()),
+    ("star_rating", pa.float64()),
+    ("num_ratings", pa.int64()),
+    ("num_reviews", pa.int64()),
+    ("genres", pa.list_(pa.string())),
+    ("first_published", pa.string()),
+    ("first_published_date", pa.timestamp("s")),  # Parsed copy that range filters compare against
+    ("kindle_price", pa.float64()),
+    ("about_author", pa.string()),  # JSON, returned with hits, never filtered
+    ("community_reviews", pa.string()),
+])
+JSON_FIELDS = ("about_author", "community_reviews")
+# Filter field -> column it is evaluated on
+FILTER_COLUMNS = {"genres": "genres", "star_rating": "star_rating", "kindle_price": "kindle_price",
+                  "first_published": "first_published_date"}
+
+
+def _coerce(field: pa.Field, value):
+    """Convert a DataFrame value to the column type; malformed values become null, as in ES."""
+    if hasattr(value, "tolist") and not isinstance(value, str):
+        value = value.tolist()  # numpy arrays and scalars
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if field.name in JSON_FIELDS:
+        return json.dumps(value, default=str)
+    if pa.types.is_list(field.type):
+        return [str(item) for item in value] if isinstance(value, (list, tuple)) else [str(value)]
+    try:
+        if pa.types.is_floating(field.type):
+            return float(value)
+        if pa.types.is_integer(field.type):
+            return int(float(value))
+    except (TypeError, ValueError):
+        return None
+    return str(value)
+
+
+def _published_dates(values: list) -> list:
+    dates = pd.to_datetime(pd.Series(values, dtype="object"), errors="coerce", format="mixed")
+    return [None if pd.isna(date) else date.to_pydatetime() for date in dates]
+
+
+class LocalVectorStoreWriter:
+    """
+    Builds a LocalVectorStore directory batch by batch.
+    Vectors are appended to a raw file and metadata to an Arrow IPC file, so memory
+    stays bounded by the batch. Each build gets its own directory "<path>.<version>" and
+    path is a symlink to the current one: finish() repoints it with a single os.replace,
+    so readers always see either the old or the new store. The previous version is kept
+    for readers that still have it open; older ones are removed.
+    """
+
+    def __init__(self, path: str, dtype="float16", dim=EMBEDDING_DIM, model_name=DEFAULT_MODEL_NAME):
+        """
+        :param dtype: "float16" halves the vectors, "int8" quarters them (see quantize_vectors)
+        """
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unknown vector dtype {dtype}, expected one of {VECTOR_DTYPES}")
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.dim = dim
+        self.model_name = model_name
+        self.count = 0
+        self.version = str(time.time_ns())
+
+        self.build_path = f"{path}.{self.version}"
+        os.makedirs(self.build_path)
+        self._vectors = open(os.path.join(self.build_path, "vectors.bin"), "wb")
+        self._norms = open(os.path.join(self.build_path, "norms.bin"), "wb")
+        self._metadata_sink = pa.OSFile(os.path.join(self.build_path, "metadata.arrow"), "wb")
+        self._metadata = pa.ipc.new_file(self._metadata_sink, METADATA_SCHEMA)
+
+    def add(self, embeddings, records: list):
+        """
+        Append one batch.
+        :param embeddings: (n, dim) float tensor or array
+        :param records: n dicts with the METADATA_SCHEMA fields (missing ones are null)
+        """
+        if len(records) == 0:
+            return
+        vectors = np.asarray(embeddings.detach().cpu() if hasattr(embeddings, "detach") else embeddings,
+                             dtype=np.float32)
+        stored = self.quantize_vectors(vectors)
+        self._vectors.write(stored.tobytes())
+        self._norms.write(np.linalg.norm(stored.astype(np.float32), axis=1).astype(np.float32).tobytes())
+
+        columns = []
+        for field in METADATA_SCHEMA:
+            if field.name == "first_published_date":
+                values = _published_dates([record.get("first_published") for record in records])
+            else:
+                values = [_coerce(field, record.get(field.name)) for record in records]
+            columns.append(pa.array(values, type=field.type))
+        self._metadata.write_batch(pa.RecordBatch.from_arrays(columns, schema=METADATA_SCHEMA))
+        self.count += len(records)
+
+    def quantize_vectors(self, vectors: np.ndarray) -> np.ndarray:
+        """Unit vectors as float16, or int8 scaled so each row's largest component is +-127."""
+        if self.dtype == np.int8:
+            return quantize_int8_array(vectors)
+        norms = np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return (vectors / norms).astype(np.float16)
+
+    def finish(self, ann="ivf", nlist=None, hnsw_m=16, ef_construction=100) -> "LocalVectorStore":
+        """
+        Close the files, build the ANN index and publish the store.
+        :param ann: "ivf" (NumPy, memory-mapped), "hnsw" (needs hnswlib, loaded into RAM) or
+                    "exact" (brute force only)
+        :param nlist: IVF lists, defaults to 4 * sqrt(count)
+        """
+        if ann not in ANN_TYPES:
+            raise ValueError(f"Unknown ANN type {ann}, expected one of {ANN_TYPES}")
+        self._vectors.close()
+        self._norms.close()
+        self._metadata.close()
+        self._metadata_sink.close()
+        with open(os.path.join(self.build_path, "index.json"), "w") as f:
+            json.dump({"dim": self.dim, "dtype": self.dtype.name, "count": self.count, "model_name": self.model_name,
+                       "ann": "exact", "version": self.version}, f)
+
+        store = LocalVectorStore(self.build_path)
+        if ann == "ivf" and store.count:
+            store.build_ivf(nlist)
+        elif ann == "hnsw" and store.count:
+            store.build_hnsw(hnsw_m, ef_construction)
+
+        previous = self.publish()
+        self.remove_old_versions(keep=(self.build_path, previous))
+        print(f"Local vector store '{self.path}' written: {self.count} vectors, {self.dtype.name}, {ann} index.")
+        return LocalVectorStore(self.path)
+
+    def publish(self):
+        """Point the path symlink at this build, returns the directory it pointed to before."""
+        previous = os.path.realpath(self.path) if os.path.exists(self.path) else None
+        if os.path.isdir(self.path) and not os.path.islink(self.path):
+            # Store written before versioned directories: move it aside once, the only non-atomic swap
+            previous = f"{self.path}.{LocalVectorStore.read_version(self.path) or 0}"
+            os.rename(self.path, previous)
+        link_path = f"{self.path}.link"
+        if os.path.lexists(link_path):
+            os.remove(link_path)
+        os.symlink(os.path.basename(self.build_path), link_path)  # Relative, so the root can move
+        os.replace(link_path, self.path)
+        return previous
+
+    def remove_old_versions(self, keep):
+        """Remove version directories of this store except keep, including interrupted builds."""
+        root, name = os.path.split(os.path.abspath(self.path))
+        keep = {os.path.realpath(path) for path in keep if path}
+        for entry in os.listdir(root):
+            version_path = os.path.join(root, entry)
+            version = entry[len(name) + 1:] if entry.startswith(f"{name}.") else ""
+            if version.isdigit() and os.path.realpath(version_path) not in keep and not os.path.islink(version_path):
+                shutil.rmtree(version_path, ignore_errors=True)
+
+
+class LocalVectorStore:
+    """
+    Read side of a vector store directory written by LocalVectorStoreWriter.
+    Vectors, norms, IVF lists and the Arrow metadata are all memory-mapped, so opening
+    is instant and only the pages a search touches are read. Scores are cosine similarity.
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.realpath(path)  # The version directory, so a rebuild does not move files underneath
+        path = self.path
+        with open(os.path.join(path, "index.json")) as f:
+            self.info = json.load(f)
+        self.count = self.info["count"]
+        self.dim = self.info["dim"]
+        self.version = self.info["version"]
+        dtype = np.dtype(self.info["dtype"])
+        self.vectors = np.memmap(os.path.join(path, "vectors.bin"), dtype=dtype, mode="r", shape=(self.count, self.dim)) \
+            if self.count else np.zeros((0, self.dim), dtype=dtype)
+        self.norms = np.memmap(os.path.join(path, "norms.bin"), dtype=np.float32, mode="r", shape=(self.count,)) \
+            if self.count else np.zeros(0, dtype=np.float32)
+        self.metadata = pa.ipc.open_file(pa.memory_map(os.path.join(path, "metadata.arrow"))).read_all()
+
+        self.centroids = self.ivf_rows = self.ivf_offsets = None
+        if self.info["ann"] == "ivf":
+            self.centroids = np.load(os.path.join(path, "ivf_centroids.npy"))
+            self.ivf_rows = np.load(os.path.join(path, "ivf_rows.npy"), mmap_mode="r")
+            self.ivf_offsets = np.load(os.path.join(path, "ivf_offsets.npy"))
+        self._hnsw = None  # Loaded on the first HNSW search
+
+    def save_info(self):
+        with open(os.path.join(self.path, "index.json"), "w") as f:
+            json.dump(self.info, f)
+
+    def block(self, rows=None, start=0, stop=None) -> np.ndarray:
+        """float32 copy of some vectors scaled to unit length."""
+        if rows is None:
+            vectors, norms = self.vectors[start:stop], self.norms[start:stop]
+        else:
+            vectors, norms = self.vectors[rows], self.norms[rows]
+        return vectors.astype(np.float32) / np.maximum(norms, 1e-12)[:, None]
+
+    def build_ivf(self, nlist=None, iterations=10, sample_size=100000, seed=0):
+        """Spherical k-means over a sample, then every row is assigned to its nearest centroid."""
+        nlist = min(nlist or max(1, int(4 * math.sqrt(self.count))), self.count)
+        rng = np.random.default_rng(seed)
+        sample = self.block(np.sort(rng.choice(self.count, min(self.count, sample_size), replace=False)))
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = np.bincount(assignment, minlength=nlist) == 0
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]  # Re-seed empty lists
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+
+        assignment = np.concatenate([np.argmax(self.block(start=start, stop=start + BLOCK_ROWS) @ centroids.T, axis=1)
+                                     for start in range(0, self.count, BLOCK_ROWS)])
+        rows = np.argsort(assignment, kind="stable").astype(np.int64)
+        offsets = np.searchsorted(assignment[rows], np.arange(nlist + 1)).astype(np.int64)
+        np.save(os.path.join(self.path, "ivf_centroids.npy"), centroids.astype(np.float32))
+        np.save(os.path.join(self.path, "ivf_rows.npy"), rows)
+        np.save(os.path.join(self.path, "ivf_offsets.npy"), offsets)
+        self.centroids, self.ivf_rows, self.ivf_offsets = centroids.astype(np.float32), rows, offsets
+        self.info.update({"ann": "ivf", "nlist": nlist})
+        self.save_info()
+
+    def build_hnsw(self, m=16, ef_construction=100):
+        import hnswlib  # Optional dependency, only needed for this index type
+
+        index = hnswlib.Index(space="ip", dim=self.dim)  # Inner product of unit vectors is cosine
+        index.init_index(max_elements=self.count, M=m, ef_construction=ef_construction)
+        for start in range(0, self.count, BLOCK_ROWS):
+            block = self.block(start=start, stop=start + BLOCK_ROWS)
+            index.add_items(block, np.arange(start, start + len(block)))
+        index.save_index(os.path.join(self.path, "hnsw.bin"))
+        self._hnsw = index
+        self.info.update({"ann": "hnsw", "m": m, "ef_construction": ef_construction})
+        self.save_info()
+
+    def hnsw(self):
+        if self._hnsw is None:
+            import hnswlib
+
+            self._hnsw = hnswlib.Index(space="ip", dim=self.dim)
+            self._hnsw.load_index(os.path.join(self.path, "hnsw.bin"), max_elements=self.count)
+        return self._hnsw
+
+    def search(self, query_vector, top_k=5, filters=None, exact=False, nprobe=8, ef=100):
+        """
+        Rows of the top_k vectors closest to query_vector.
+        Filtered searches score every matching row exactly, like an ES pre-filter, so
+        top_k matches come back however selective the filter is.
+        :param exact: brute force over all rows instead of the ANN index
+        :param nprobe: IVF lists scanned per query
+        :param ef: HNSW candidate list size, like num_candidates in ES
+        :return: (rows, scores), best first
+        """
+        query = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        if filters:
+            return self.exact_search(query, top_k, self.filter_rows(filters))
+        if exact or self.info["ann"] == "exact":
+            return self.exact_search(query, top_k)
+        if self.info["ann"] == "hnsw":
+            index = self.hnsw()
+            index.set_ef(max(ef, top_k))
+            labels, distances = index.knn_query(query, k=min(top_k, self.count))
+            return labels[0].astype(np.int64), 1.0 - distances[0]
+        probe = np.argsort(-(self.centroids @ query))[:nprobe]
+        rows = np.concatenate([self.ivf_rows[self.ivf_offsets[c]:self.ivf_offsets[c + 1]] for c in probe])
+        return self.exact_search(query, top_k, np.sort(rows))  # Sorted rows read the memmap front to back
+
+    def exact_search(self, query: np.ndarray, top_k: int, rows=None):
+        """Brute-force top_k over all rows, or over the given sorted row ids, block by block."""
+        total = self.count if rows is None else len(rows)
+        best_rows, best_scores = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        for start in range(0, total, BLOCK_ROWS):
+            if rows is None:
+                block_rows = np.arange(start, min(start + BLOCK_ROWS, total))
+                scores = self.block(start=start, stop=start + BLOCK_ROWS) @ query
+            else:
+                block_rows = rows[start:start + BLOCK_ROWS]
+                scores = self.block(block_rows) @ query
+            best_rows = np.concatenate([best_rows, block_rows])
+            best_scores = np.concatenate([best_scores, scores])
+            if len(best_rows) > top_k:
+                keep = np.argpartition(-best_scores, top_k)[:top_k]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+        order = np.argsort(-best_scores, kind="stable")
+        return best_rows[order], best_scores[order]
+
+    def filter_rows(self, filters: dict) -> np.ndarray:
+        """
+        Row ids matching every filter, in the format of ElasticsearchRetriever.build_filter_clauses:
+        a list matches any of its values, a dict is a gte/gt/lte/lt range, anything else must be equal.
+        """
+        mask = np.ones(self.count, dtype=bool)
+        for field, value in filters.items():
+            if field not in FILTER_COLUMNS:
+                raise ValueError(f"Cannot filter on '{field}', expected one of {tuple(FILTER_COLUMNS)}")
+            column = self.metadata.column(FILTER_COLUMNS[field]).combine_chunks()
+            if isinstance(value, dict):
+                field_mask = np.ones(self.count, dtype=bool)
+                for op, bound in value.items():
+                    if field == "first_published":
+                        bound = pa.scalar(pd.Timestamp(bound).to_pydatetime(), type=column.type)
+                    compare = {"gte": pc.greater_equal, "gt": pc.greater, "lte": pc.less_equal, "lt": pc.less}[op]
+                    field_mask &= compare(column, bound).fill_null(False).to_numpy(zero_copy_only=False)
+            else:
+                values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+                if pa.types.is_list(column.type):
+                    # Keyword arrays match when any element matches
+                    flat = pc.is_in(pc.list_flatten(column), value_set=pa.array([str(v) for v in values]))
+                    parents = pc.list_parent_indices(column).to_numpy()
+                    field_mask = np.zeros(self.count, dtype=bool)
+                    field_mask[parents[flat.fill_null(False).to_numpy(zero_copy_only=False)]] = True
+                else:
+                    value_set = pa.array(values).cast(column.type)
+                    field_mask = pc.is_in(column, value_set=value_set).fill_null(False).to_numpy(zero_copy_only=False)
+            mask &= field_mask
+        return np.flatnonzero(mask)
+
+    def documents(self, rows) -> list:
+        """Metadata of the given rows as _source dicts."""
+        if len(rows) == 0:
+            return []
+        documents = self.metadata.take(pa.array(np.asarray(rows, dtype=np.int64))).to_pylist()
+        for doc in documents:
+            doc.pop("first_published_date", None)
+            for field in JSON_FIELDS:
+                if doc.get(field) is not None:
+                    doc[field] = json.loads(doc[field])
+        return documents
+
+    @staticmethod
+    def read_version(path: str):
+        """Version of the store at path without opening it, None if there is none."""
+        try:
+            with open(os.path.join(path, "index.json")) as f:
+                return json.load(f)["version"]
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError) as e:
+            logging.error(f"Unreadable local store info in {path}: {e}")
+            return None
@@ -0,0 +1,65 @@
+import json
+import logging
+import os
+
+
+class IndexManifest:
+    """
+    Local record of what an index already holds, used for incremental re-indexing.
+    Stored as an append-only JSONL file: one line per committed book
+    ({"id", "hash", "chunks"}) plus checkpoint lines ({"checkpoint": {...}}).
+    Appending keeps each commit cheap, and a torn last line after a crash is skipped on load.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.books = {}  # book id -> {"hash": str, "chunks": int}
+        self.checkpoint = None
+        self.load()
+
+    def load(self):
+        """Replay the manifest file, later lines win."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, start=1):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warning(f"Skipping unreadable line {line_no} in manifest {self.path}")
+                    continue
+                if "checkpoint" in entry:
+                    self.checkpoint = entry["checkpoint"]
+                else:
+                    self.books[entry["id"]] = {"hash": entry["hash"], "chunks": entry["chunks"]}
+        print(f"Loaded manifest {self.path} with {len(self.books)} books.")
+
+    def lookup(self, book_ids) -> dict:
+        """Known hash and chunk count for the given book ids."""
+        return {book_id: self.books[book_id] for book_id in book_ids if book_id in self.books}
+
+    def commit(self, updates: dict, checkpoint: dict = None):
+        """Durably record a committed batch of books and, optionally, the new checkpoint."""
+        lines = [json.dumps({"id": book_id, **entry}) for book_id, entry in updates.items()]
+        if checkpoint is not None:
+            lines.append(json.dumps({"checkpoint": checkpoint}))
+        if not lines:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.books.update(updates)
+        if checkpoint is not None:
+            self.checkpoint = checkpoint
+
+    def compact(self):
+        """Rewrite the file with one line per book and no checkpoint, e.g. after a completed run."""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for book_id, entry in self.books.items():
+                f.write(json.dumps({"id": book_id, **entry}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)  # Atomic swap
+        self.checkpoint = None
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+from indexing.embedding import DEFAULT_MODEL_NAME, DEFAULT_BACKEND
+from indexing.model_registry import get_embedding_model
+
+
+_STOP = object()  # Sentinel that shuts the batching thread down
+
+
+class MicroBatchEmbedder:
+    """
+    Coalesces query embeddings from many concurrent callers into batched forward passes.
+    A background thread waits for the first text, then keeps collecting for up to
+    max_wait_ms or until max_batch_size texts are queued, runs one get_embeddings call
+    and resolves each caller's future with its own row.
+    """
+
+    def __init__(self, model=None, max_batch_size=32, max_wait_ms=5.0, model_name=DEFAULT_MODEL_NAME,
+                 backend=DEFAULT_BACKEND):
+        """
+        :param model: EmbeddingModel to batch for, defaults to the registry's shared model_name and backend
+        :param max_batch_size: texts per forward pass
+        :param max_wait_ms: longest a text waits for others to join its batch
+        """
+        self.model = model if model is not None else get_embedding_model(model_name, backend)
+        # What the vectors come from, checked by retrievers the batcher is attached to
+        self.model_name = self.model.model_name
+        self.backend = self.model.backend  # What actually runs, eager if the requested backend fell back
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+
+        self._metrics_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._queue_wait_seconds = 0.0
+        self._last_queue_depth = 0
+        self._max_queue_depth = 0
+
+        self._worker = threading.Thread(target=self._run, name="query-micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue text for embedding; the future resolves to its 384-dim tensor."""
+        future = Future()
+        self.queue.put((text, future, time.perf_counter()))
+        return future
+
+    def embed(self, text: str, timeout=None) -> torch.Tensor:
+        """Blocking embed for thread-based callers."""
+        return self.submit(text).result(timeout)
+
+    async def embed_async(self, text: str) -> torch.Tensor:
+        """Awaitable embed that does not tie up an executor thread while waiting."""
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True  # Finish this batch, then exit
+                    break
+                batch.append(item)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        # Drop callers that gave up while queued
+        batch = [(text, future, queued_at) for text, future, queued_at in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        started = time.perf_counter()
+        with self._metrics_lock:
+            self._batches += 1
+            self._items += len(batch)
+            self._queue_wait_seconds += sum(started - queued_at for _, _, queued_at in batch)
+            self._last_queue_depth = self.queue.qsize()
+            self._max_queue_depth = max(self._max_queue_depth, self._last_queue_depth)
+
+        try:
+            vectors = self.model.get_embeddings([text for text, _, _ in batch], batch_size=len(batch))
+        except Exception as e:
+            logging.error(f"Error in micro-batched embedding: {e}")
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, _), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+    def metrics(self) -> dict:
+        """Batching counters: fill is the mean batch size relative to max_batch_size."""
+        with self._metrics_lock:
+            mean_batch = self._items / self._batches if self._batches else 0.0
+            return {
+                "batches": self._batches,
+                "items": self._items,
+                "mean_batch_size": mean_batch,
+                "batch_fill": mean_batch / self.max_batch_size,
+                "mean_queue_wait_ms": 1000 * self._queue_wait_seconds / self._items if self._items else 0.0,
+                "queue_depth": self._last_queue_depth,
+                "max_queue_depth": self._max_queue_depth,
+            }
+
+    def close(self):
+        """Embed whatever is queued, then stop the batching thread."""
+        self.queue.put(_STOP)
+        self._worker.join()
@@ -0,0 +1,92 @@
+import logging
+import resource
+import threading
+import time
+
+from indexing.embedding import EmbeddingModel, DEFAULT_MODEL_NAME, DEFAULT_BACKEND
+
+
+def resident_memory_mb() -> float:
+    """Current resident set size of this process in MB (peak RSS if /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * resource.getpagesize() / (1024 * 1024)
+    except (OSError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+
+class ModelRegistry:
+    """
+    Process-wide, thread-safe cache of EmbeddingModel instances keyed by model name and backend.
+    A model is loaded and warmed up on first request only; every later caller gets
+    the same instance.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name=DEFAULT_MODEL_NAME, backend=DEFAULT_BACKEND, warm_up=True) -> EmbeddingModel:
+        """Return the shared model for model_name and backend, loading it on first use."""
+        key = f"{model_name}:{backend}"
+        model = self._models.get(key)
+        if model is not None:
+            return model
+
+        with self._lock:
+            # Another thread may have loaded it while we waited for the lock
+            model = self._models.get(key)
+            if model is not None:
+                return model
+
+            rss_before = resident_memory_mb()
+            start = time.perf_counter()
+            model = EmbeddingModel(model_name, backend=backend)
+            load_seconds = time.perf_counter() - start
+            if model.model is None:
+                return model  # Load failed and was logged; do not cache, retry on next call
+
+            warmup_seconds = self.warm_up(model) if warm_up else 0.0
+
+            self._stats[key] = {
+                "load_seconds": load_seconds,
+                "warmup_seconds": warmup_seconds,
+                "rss_before_mb": rss_before,
+                "rss_after_mb": resident_memory_mb(),
+            }
+            self._models[key] = model
+            stats = self._stats[key]
+            print(f"Loaded {key} in {load_seconds:.2f}s (warm-up {warmup_seconds:.2f}s), "
+                  f"RSS {stats['rss_before_mb']:.0f} -> {stats['rss_after_mb']:.0f} MB")
+            return model
+
+    @staticmethod
+    def warm_up(model: EmbeddingModel) -> float:
+        """Run one throwaway forward pass so the first real query does not pay for lazy init."""
+        start = time.perf_counter()
+        try:
+            model.get_embeddings(["warm up", "a slightly longer warm up sentence for padding"])
+        except Exception as e:
+            logging.error(f"Error warming up model {model.model_name}: {e}")
+        return time.perf_counter() - start
+
+    def stats(self) -> dict:
+        """Load time and memory figures for every model loaded so far."""
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+    def clear(self):
+        """Drop all cached models, the next get() reloads from disk."""
+        with self._lock:
+            self._models.clear()
+            self._stats.clear()
+
+
+registry = ModelRegistry()
+
+
+def get_embedding_model(model_name=DEFAULT_MODEL_NAME, backend=DEFAULT_BACKEND) -> EmbeddingModel:
+    """Shortcut for the process-wide registry."""
+    return registry.get(model_name, backend)
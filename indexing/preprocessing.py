@@ -1,15 +1,83 @@
 from nltk.tokenize import sent_tokenize
+from transformers import AutoTokenizer
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import multiprocessing
+import pandas as pd
 import logging
 import re
 
+
+NON_ALPHANUMERIC = re.compile(r'[^A-Za-z0-9\s]')  # Compiled once, shared by every cleaning call
+PARALLEL_MIN_TEXTS = 256  # Below this, process pool overhead outweighs the parallel speed-up
+
+
+def pack_sentences(text: str, chunk_size: int) -> list[str]:
+    """Pack the sentences of text into chunks of under chunk_size characters."""
+    sentences = sent_tokenize(text)
+    chunks = []
+    current_chunk = ""
+    for sentence in sentences:
+        if len(current_chunk) + len(sentence) < chunk_size:
+            current_chunk += " " + sentence
+        else:
+            chunks.append(current_chunk)
+            current_chunk = sentence
+    if current_chunk:
+        chunks.append(current_chunk)
+    return chunks
+
+
+def flatten_chunks(batch_chunks) -> tuple[list[int], list[str]]:
+    """
+    Flatten per-row chunk lists into the flat text list the embedder takes.
+    :return: (row position of each chunk, chunks), empty chunks dropped
+    """
+    positions, chunks = [], []
+    for position, row_chunks in enumerate(batch_chunks):
+        for chunk in row_chunks:
+            if chunk:
+                positions.append(position)
+                chunks.append(chunk)
+    return positions, chunks
+
+
 class DataPreprocessor:
-    def __init__(self, chunk_size=512):
+    def __init__(self, chunk_size=512, tokenizer_name=None, chunk_tokens=None, overlap_tokens=32, num_workers=0):
+        """
+        :param chunk_size: character budget of sentence-packed chunks (default mode)
+        :param tokenizer_name: switches to token-budget chunking measured with this fast tokenizer,
+                               normally the embedding model's own
+        :param chunk_tokens: tokens per chunk, defaults to what the model sees without truncation
+        :param overlap_tokens: tokens repeated at the start of the next chunk
+        :param num_workers: processes used for sentence splitting of a column in character mode
+        """
         self.chunk_size = chunk_size
+        self.num_workers = num_workers
+        self._pool = None
+        self.tokenizer_name = tokenizer_name
+        self.tokenizer = None
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        if tokenizer_name:
+            self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, use_fast=True) #offsets need a fast tokenizer
+            if self.chunk_tokens is None:
+                # MiniLM was trained on 256 tokens; leave room for [CLS] and [SEP]
+                self.chunk_tokens = min(self.tokenizer.model_max_length, 256) - 2
+            if not 0 <= self.overlap_tokens < self.chunk_tokens:
+                raise ValueError(f"overlap_tokens must be in [0, {self.chunk_tokens}), got {self.overlap_tokens}")
+
+    def get_config(self) -> dict:
+        """Settings that change the produced chunks, e.g. for keying cached embeddings."""
+        if self.tokenizer is None:
+            return {"chunk_size": self.chunk_size}
+        return {"tokenizer": self.tokenizer_name, "chunk_tokens": self.chunk_tokens,
+                "overlap_tokens": self.overlap_tokens}
 
     def preprocess_text(self, text: str) -> str:
         """Remove non-alphanumeric characters."""
         try:
-            return re.sub(r'[^A-Za-z0-9\s]', '', text)
+            return NON_ALPHANUMERIC.sub('', text)
         except Exception as e:
             logging.error(f"Error during text preprocessing: {e}") #logging helps in debugging
             return ""
@@ -17,22 +85,92 @@ class DataPreprocessor:
     def split_text_into_chunks(self, text: str) -> list[str]:
         """Split text into smaller chunks."""
         try:
-            sentences = sent_tokenize(text)
-            chunks = []
-            current_chunk = ""
-            for sentence in sentences:
-                if len(current_chunk) + len(sentence) < self.chunk_size:
-                    current_chunk += " " + sentence
-                else:
-                    chunks.append(current_chunk)
-                    current_chunk = sentence
-            if current_chunk:
-                chunks.append(current_chunk)
-            return chunks
+            return pack_sentences(text, self.chunk_size)
         except Exception as e:
             logging.error(f"Error during text chunking: {e}")
             return []
-        
+
+    def preprocess_series(self, texts) -> list[str]:
+        """Vectorized preprocess_text over a whole column; missing values become ""."""
+        try:
+            try:
+                # Arrow-backed strings run the regex in pyarrow compute, outside the interpreter loop
+                series = pd.Series(texts, dtype="string[pyarrow]")
+                cleaned = series.str.replace(NON_ALPHANUMERIC.pattern, "", regex=True)
+            except ImportError:
+                series = pd.Series(texts, dtype="string")
+                cleaned = series.str.replace(NON_ALPHANUMERIC, "", regex=True)
+            return cleaned.fillna("").tolist()
+        except Exception as e:
+            logging.error(f"Error during column preprocessing: {e}")
+            return [self.preprocess_text(text) if isinstance(text, str) else "" for text in texts]
+
+    def split_sentences_parallel(self, texts: list[str]) -> list[list[str]]:
+        """Character-mode chunking of many texts, spread over the process pool."""
+        if self.num_workers <= 1 or len(texts) < PARALLEL_MIN_TEXTS:
+            return [self.split_text_into_chunks(text) for text in texts]
+        if self._pool is None:
+            # spawn, not fork: the indexer calls this from a thread, and forking threaded processes is unsafe
+            self._pool = ProcessPoolExecutor(max_workers=self.num_workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        # A few large work units per worker keeps pickling overhead low
+        chunksize = max(1, len(texts) // (self.num_workers * 4))
+        try:
+            return list(self._pool.map(partial(pack_sentences, chunk_size=self.chunk_size), texts, chunksize=chunksize))
+        except Exception as e:
+            logging.error(f"Error during parallel text chunking: {e}")
+            return [self.split_text_into_chunks(text) for text in texts]
+
+    def split_series_into_chunks(self, texts) -> list[list[str]]:
+        """
+        Clean and chunk a whole column (pandas Series or list) at once.
+        Cleaning is vectorized; in token mode the column is tokenized in one batched
+        call, otherwise sentence splitting runs in the process pool.
+        :return: one list of chunks per input text, see flatten_chunks
+        """
+        cleaned = self.preprocess_series(texts)
+        if self.tokenizer is None:
+            return self.split_sentences_parallel(cleaned)
+        try:
+            encoded = self.tokenizer(cleaned, add_special_tokens=False, return_offsets_mapping=True,
+                                     return_attention_mask=False, return_token_type_ids=False)
+            return [self.split_offsets_into_chunks(text, offsets)
+                    for text, offsets in zip(cleaned, encoded["offset_mapping"])]
+        except Exception as e:
+            logging.error(f"Error during token chunking: {e}")
+            return [[] for _ in cleaned]
+
+    def split_offsets_into_chunks(self, text: str, offsets) -> list[str]:
+        """
+        Cut text into windows of at most chunk_tokens tokens, consecutive windows sharing
+        overlap_tokens tokens. A window is shortened rather than split inside a word.
+        :param offsets: (start, end) character span of every token in text
+        """
+        if not offsets:
+            return [text.strip()] if text.strip() else []
+        chunks = []
+        start = 0
+        while start < len(offsets):
+            end = min(start + self.chunk_tokens, len(offsets))
+            if end < len(offsets):
+                # Step back while the next token continues the previous one (word piece)
+                boundary = end
+                while boundary > start + 1 and offsets[boundary][0] == offsets[boundary - 1][1]:
+                    boundary -= 1
+                if offsets[boundary][0] != offsets[boundary - 1][1]:
+                    end = boundary
+            chunks.append(text[offsets[start][0]:offsets[end - 1][1]].strip())
+            if end == len(offsets):
+                break
+            start = max(end - self.overlap_tokens, start + 1)
+        return chunks
+
+    def close(self):
+        """Shut down the sentence splitting pool, if one was started."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
     def test_methods(self):
         "Test the two preprocessing methods"
 
@@ -0,0 +1,56 @@
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from indexing.search import ElasticsearchRetriever
+
+
+SAMPLE_QUERIES = [
+    "Find me books that have a summary like a murder mystery in a small town. The protagonist must be female.",
+    "An epic fantasy about a young farm boy who discovers he is the heir to a lost kingdom",
+    "A heartwarming romance between two rivals running competing bakeries",
+    "Hard science fiction about the first crewed mission to Mars",
+    "A biography of a famous jazz musician",
+    "Dystopian novel where the government controls every aspect of daily life",
+]
+
+
+def index_size_bytes(retriever: ElasticsearchRetriever, index_name: str) -> int:
+    """Primary store size of the index (or of the index behind an alias)."""
+    stats = retriever.es.indices.stats(index=index_name, metric="store")
+    return stats["_all"]["primaries"]["store"]["size_in_bytes"]
+
+
+def compare_recall(float_index="goodreads", quantized_index="goodreads_byte", vector_storage="byte",
+                   queries=SAMPLE_QUERIES, top_k=10) -> dict:
+    """
+    Recall@top_k of kNN on the quantized index, with exact float search as ground truth.
+    Both indices must hold the same chunk ids. kNN on the float index is reported too,
+    so HNSW approximation and quantization loss can be told apart.
+    """
+    float_retriever = ElasticsearchRetriever()
+    quantized_retriever = ElasticsearchRetriever(vector_storage=vector_storage)
+
+    float_recall, quantized_recall = [], []
+    for query in queries:
+        truth = {hit["_id"] for hit in float_retriever.search_hits(query, float_index, semantic=False, top_k=top_k)}
+        if not truth:
+            continue
+        float_ids = {hit["_id"] for hit in float_retriever.search_hits(query, float_index, top_k=top_k)}
+        quantized_ids = {hit["_id"] for hit in quantized_retriever.search_hits(query, quantized_index, top_k=top_k)}
+        float_recall.append(len(truth & float_ids) / len(truth))
+        quantized_recall.append(len(truth & quantized_ids) / len(truth))
+
+    return {
+        "queries": len(float_recall),
+        "float_knn_recall": sum(float_recall) / len(float_recall) if float_recall else 0.0,
+        "quantized_knn_recall": sum(quantized_recall) / len(quantized_recall) if quantized_recall else 0.0,
+        "float_index_bytes": index_size_bytes(float_retriever, float_index),
+        "quantized_index_bytes": index_size_bytes(quantized_retriever, quantized_index),
+    }
+
+
+if __name__ == "__main__":
+
+    print(compare_recall())
@@ -0,0 +1,123 @@
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """Case and whitespace insensitive form of a query, used as the exact cache key."""
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+def params_key(**params) -> str:
+    """Stable key for search parameters (index version, top_k, filters, mode, ...)."""
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+class SearchResultCache:
+    """
+    Two-level cache of vector_search results.
+    Level 1 is an exact LRU keyed on the normalized query text plus the search parameters.
+    Level 2, enabled by semantic_threshold, returns the results of an earlier query with
+    the same parameters whose embedding has at least that cosine similarity.
+    Both levels are LRU bounded and expire after ttl_seconds. The index version belongs
+    in the parameters, so an alias swap makes old entries unreachable.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=300, semantic_threshold=None, max_semantic_entries=256):
+        """
+        :param semantic_threshold: e.g. 0.95; None disables the semantic level
+        :param max_semantic_entries: embeddings kept for semantic lookups, across all parameters
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.semantic_threshold = semantic_threshold
+        self.max_semantic_entries = max_semantic_entries
+        self._exact = OrderedDict()  # (query, params) -> (stored_at, documents)
+        self._semantic = OrderedDict()  # (query, params) -> (stored_at, unit vector, documents)
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _fresh(self, stored_at) -> bool:
+        return time.monotonic() - stored_at < self.ttl_seconds
+
+    @staticmethod
+    def _copy(documents):
+        return [dict(doc) for doc in documents]  # Callers may edit their results
+
+    def get_exact(self, query_text: str, params: str):
+        """Cached documents for this exact query and parameters, or None."""
+        key = (normalize_query(query_text), params)
+        with self._lock:
+            entry = self._exact.get(key)
+            if entry is not None and self._fresh(entry[0]):
+                self._exact.move_to_end(key)
+                self.exact_hits += 1
+                return self._copy(entry[1])
+            if entry is not None:
+                del self._exact[key]
+            return None
+
+    def get_semantic(self, query_embedding, params: str):
+        """Documents of the most similar cached query with the same parameters, or None; counts a miss."""
+        with self._lock:
+            if self.semantic_threshold is not None:
+                candidates = [(key, entry) for key, entry in self._semantic.items()
+                              if key[1] == params and self._fresh(entry[0])]
+                if candidates:
+                    query = self._unit(query_embedding)
+                    similarities = np.stack([entry[1] for _, entry in candidates]) @ query
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.semantic_threshold:
+                        key, entry = candidates[best]
+                        self._semantic.move_to_end(key)
+                        self.semantic_hits += 1
+                        return self._copy(entry[2])
+            self.misses += 1
+            return None
+
+    def put(self, query_text: str, query_embedding, params: str, documents):
+        key = (normalize_query(query_text), params)
+        now = time.monotonic()
+        with self._lock:
+            self._exact[key] = (now, self._copy(documents))
+            self._exact.move_to_end(key)
+            while len(self._exact) > self.max_entries:
+                self._exact.popitem(last=False)
+            if self.semantic_threshold is not None and query_embedding is not None:
+                self._semantic[key] = (now, self._unit(query_embedding), self._exact[key][1])
+                self._semantic.move_to_end(key)
+                while len(self._semantic) > self.max_semantic_entries:
+                    self._semantic.popitem(last=False)
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        vector = np.asarray(embedding.detach().cpu() if hasattr(embedding, "detach") else embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def invalidate(self):
+        """Drop every entry, e.g. after indexing into a live index in place."""
+        with self._lock:
+            self._exact.clear()
+            self._semantic.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+                "exact_entries": len(self._exact),
+                "semantic_entries": len(self._semantic),
+            }
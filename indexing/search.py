@@ -1,66 +1,219 @@
 import numpy as np
 from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import NotFoundError
 import sys
 import os 
+import time
 
 
-from indexing.embedding import EmbeddingModel
+from indexing.embedding import DEFAULT_MODEL_NAME, DEFAULT_BACKEND, quantize_int8
+from indexing.model_registry import get_embedding_model
+from indexing.elasticsearch_idx import books_index_name
+from indexing.result_cache import params_key
+
+
+SOURCE_FIELDS = ["name", "author", "url", "genres", "star_rating", "first_published", "kindle_price", "summary_chunk"]
+FILTER_FIELDS = ("genres", "star_rating", "first_published", "kindle_price")
+# Compact layout: what the chunk hits carry, and what is joined in from the books index
+CHUNK_SOURCE_FIELDS = ["book_id", "genres", "star_rating", "first_published", "kindle_price", "summary_chunk"]
+BOOK_SOURCE_FIELDS = ["name", "author", "url"]
 
 class ElasticsearchRetriever:
-    def __init__(self, es_host='localhost', es_port=9200, es_scheme='http'):
+    def __init__(self, es_host='localhost', es_port=9200, es_scheme='http', model_name=DEFAULT_MODEL_NAME,
+                 embedding_backend=DEFAULT_BACKEND, num_candidates=100, vector_storage="float",
+                 layout="full", es_client=None, query_batcher=None, result_cache=None,
+                 version_check_seconds=30):
+        self.es = es_client if es_client is not None else self.connect(es_host, es_port, es_scheme)
+        self.model_name = model_name
+        self.embedding_backend = embedding_backend
+        self.num_candidates = num_candidates  # Default kNN candidate pool; larger is slower but more accurate
+        self.vector_storage = vector_storage  # "byte" indices need int8 query vectors, see quantize_int8
+        self.layout = layout  # "compact" joins book metadata from the books index after the search
+        self.query_batcher = query_batcher  # Optional MicroBatchEmbedder shared by concurrent callers
+        self._checked_batcher = None  # query_batcher once it matched model_name and embedding_backend
+        self.result_cache = result_cache  # Optional SearchResultCache in front of vector_search
+        self.version_check_seconds = version_check_seconds  # How long a resolved alias target is trusted
+        self._index_versions = {}  # index or alias -> (concrete indices, checked_at)
+
+    @staticmethod
+    def connect(es_host, es_port, es_scheme):
         # Specify the scheme explicitly (http or https)
-        self.es = Elasticsearch([{'host': es_host, 'port': es_port, 'scheme': es_scheme}])
+        return Elasticsearch([{'host': es_host, 'port': es_port, 'scheme': es_scheme}])
 
-    def vector_search(self, query_text: str, index_name: str, semantic=True, top_k=5):
-        # Get the embedding for the query text
+    def vector_search(self, query_text: str, index_name: str, semantic=True, top_k=5, filters=None,
+                      num_candidates=None):
+        """
+        Return the _source of the top_k chunks closest to query_text.
+        :param semantic: approximate kNN over the HNSW graph; False scores candidates exactly
+        :param filters: e.g. {"genres": ["Mystery"], "star_rating": {"gte": 4}}, see build_filter_clauses
+        :param num_candidates: kNN candidates per shard, defaults to self.num_candidates
+        """
+        if self.result_cache is None:
+            hits = self.search_hits(query_text, index_name, semantic, top_k, filters, num_candidates)
+            return [hit["_source"] for hit in hits]
+
+        params = self.cache_params(self.index_version(index_name), index_name, semantic, top_k, filters, num_candidates)
+        documents = self.result_cache.get_exact(query_text, params)
+        if documents is not None:
+            return documents
         query_embedding = self.get_embedding(query_text)
-        
-        # Convert the embedding to a list for Elasticsearch query
-        query_embedding_list = query_embedding.cpu().detach().numpy().tolist() #move to cpu, detach from comp grap
+        documents = self.result_cache.get_semantic(query_embedding, params)
+        if documents is not None:
+            return documents
+
+        hits = self.search_hits(query_text, index_name, semantic, top_k, filters, num_candidates, query_embedding)
+
+        # Extract and return the top-k documents
+        documents = [hit["_source"] for hit in hits]
+        self.result_cache.put(query_text, query_embedding, params, documents)
+        return documents
+
+    def cache_params(self, version, index_name, semantic, top_k, filters, num_candidates) -> str:
+        """Everything besides the query text that changes the result of a search."""
+        return params_key(index=index_name, version=version, semantic=semantic, top_k=top_k, filters=filters,
+                          num_candidates=num_candidates or self.num_candidates, layout=self.layout)
+
+    def index_version(self, index_name: str) -> str:
+        """
+        Concrete indices behind index_name, re-checked every version_check_seconds.
+        An alias swap after a rebuild changes it, which invalidates cached results.
+        """
+        cached = self._index_versions.get(index_name)
+        if cached is not None and time.monotonic() - cached[1] < self.version_check_seconds:
+            return cached[0]
+        try:
+            version = ",".join(sorted(self.es.indices.get_alias(name=index_name).keys()))
+        except NotFoundError:
+            version = index_name  # A concrete index, not an alias
+        self._index_versions[index_name] = (version, time.monotonic())
+        return version
+
+    def search_hits(self, query_text: str, index_name: str, semantic=True, top_k=5, filters=None,
+                    num_candidates=None, query_embedding=None) -> list:
+        """
+        Like vector_search, but returns the raw hits with _id and _score.
+        :param query_embedding: skips embedding query_text when the caller already has it
+        """
+        # Get the embedding for the query text
+        if query_embedding is None:
+            query_embedding = self.get_embedding(query_text)
+        body = self.build_query(self.query_vector(query_embedding), semantic, top_k, filters, num_candidates)
+
+        # Perform the search
+        response = self.es.search(index=index_name, body=body)
+        hits = response["hits"]["hits"]
+        if self.layout == "compact":
+            self.join_books(hits, index_name)
+        return hits
+
+    def join_books(self, hits: list, index_name: str):
+        """Add each book's metadata to its chunk hits, with one mget for all distinct books."""
+        book_ids = self.hit_book_ids(hits)
+        if not book_ids:
+            return
+        response = self.es.mget(index=books_index_name(index_name), ids=book_ids, source_includes=BOOK_SOURCE_FIELDS)
+        self.merge_books(hits, response)
+
+    @staticmethod
+    def hit_book_ids(hits: list) -> list:
+        """Distinct book ids of compact-layout hits, in hit order."""
+        return list(dict.fromkeys(hit["_source"]["book_id"] for hit in hits if "book_id" in hit["_source"]))
+
+    @staticmethod
+    def merge_books(hits: list, mget_response):
+        """Copy the book documents of an mget response into the matching hits."""
+        books = {doc["_id"]: doc["_source"] for doc in mget_response["docs"] if doc.get("found")}
+        for hit in hits:
+            hit["_source"].update(books.get(hit["_source"].get("book_id"), {}))
+
+    def query_vector(self, query_embedding) -> list:
+        """Query embedding as a JSON list in the element type of the index."""
+        query_embedding = query_embedding.cpu().detach()  #move to cpu, detach from comp graph
+        if self.vector_storage == "byte":
+            query_embedding = quantize_int8(query_embedding)
+        return query_embedding.numpy().tolist()
+
+    def build_query(self, query_vector: list, semantic=True, top_k=5, filters=None, num_candidates=None) -> dict:
+        """Search body for a query vector; filters are applied before scoring in both modes."""
+        clauses = self.build_filter_clauses(filters)
 
         # Create the query body for Elasticsearch vector search
-        #Defining a custom cosine similarity script score as script_score for matching with all documents
         if semantic:
-            body = {
-                        "query": {
-                            "knn": {
-                                "field": "embedding",  # The field storing the vectors
-                                "query_vector": query_embedding_list,  # Query vector from the user input
-                                "k": top_k  # Return top-k results
-                            }
-                        },
-                        "_source": ["name", "author", "url", "genres", "star_rating", "first_published", "kindle_price", "summary_chunk"],  # Fields to return
-                        "size": top_k  # Number of top documents to return
-                    }
+            knn = {
+                "field": "embedding",  # The field storing the vectors
+                "query_vector": query_vector,  # Query vector from the user input
+                "k": top_k,  # Return top-k results
+                "num_candidates": max(num_candidates or self.num_candidates, top_k),
+            }
+            if clauses:
+                # Pre-filter: the HNSW search only visits matching chunks, so top_k hits still come back
+                knn["filter"] = {"bool": {"filter": clauses}}
+            query = {"knn": knn}
         else:
-            body = {
-                "query": {
-                    "script_score": {
-                        "query": {
-                            "match_all": {}
-                        },
-                        "script": {
-                            "source": "cosineSimilarity(params.query_vector, 'embedding') + 1.0",
-                            "params": {
-                                "query_vector": query_embedding_list
-                            }
+            # Exact cosine similarity via script_score, only over the chunks that pass the filters
+            query = {
+                "script_score": {
+                    "query": {"bool": {"filter": clauses}} if clauses else {"match_all": {}},
+                    "script": {
+                        "source": "cosineSimilarity(params.query_vector, 'embedding') + 1.0",
+                        "params": {
+                            "query_vector": query_vector
                         }
                     }
-                },
-                "_source": ["name", "author", "url", "genres", "star_rating", "first_published", "kindle_price", "summary_chunk"],  # Specify which fields to return
-                "size": top_k  # Number of top documents to return
+                }
             }
 
-        # Perform the search
-        response = self.es.search(index=index_name, body=body)
-        
-        # Extract and return the top-k documents
-        documents = [hit["_source"] for hit in response["hits"]["hits"]]
-        return documents
+        return {
+            "query": query,
+            "_source": CHUNK_SOURCE_FIELDS if self.layout == "compact" else SOURCE_FIELDS,  # Fields to return
+            "size": top_k  # Number of top documents to return
+        }
+
+    @staticmethod
+    def build_filter_clauses(filters) -> list:
+        """
+        Turn structured filters into ES filter clauses.
+        A list becomes a terms clause (any of), a dict a range clause (gte/gt/lte/lt),
+        anything else a term clause.
+        """
+        clauses = []
+        for field, value in (filters or {}).items():
+            if field not in FILTER_FIELDS:
+                raise ValueError(f"Cannot filter on '{field}', expected one of {FILTER_FIELDS}")
+            if isinstance(value, (list, tuple, set)):
+                clauses.append({"terms": {field: list(value)}})
+            elif isinstance(value, dict):
+                clauses.append({"range": {field: value}})
+            else:
+                clauses.append({"term": {field: value}})
+        return clauses
+
+    def check_query_batcher(self):
+        """
+        Refuse a query batcher whose vectors come from another model or backend than this retriever's.
+        The batcher reports the backend that actually runs, so one that fell back to eager
+        only pairs with an eager retriever.
+        """
+        batcher = self.query_batcher
+        if batcher is self._checked_batcher:
+            return
+        if batcher.model_name != self.model_name or batcher.backend != self.embedding_backend:
+            raise ValueError(f"Query batcher embeds with {batcher.model_name} ({batcher.backend}), "
+                             f"retriever expects {self.model_name} ({self.embedding_backend})")
+        self._checked_batcher = batcher
 
     def get_embedding(self, text: str):
-        embed = EmbeddingModel()
+        if self.query_batcher is not None:
+            self.check_query_batcher()
+            return self.query_batcher.embed(text)
+        # Shared model from the process-wide registry, loaded once on first use
+        embed = get_embedding_model(self.model_name, self.embedding_backend)
         return embed.get_embedding(text)
+
+    def get_embeddings(self, texts: list):
+        """Embed several queries in one batched forward pass."""
+        embed = get_embedding_model(self.model_name, self.embedding_backend)
+        return embed.get_embeddings(texts)
     
 
 if __name__ == "__main__":
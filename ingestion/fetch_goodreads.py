@@ -1,52 +1,142 @@
+import argparse
 import boto3
 import json
 import os
-from datasets import load_dataset
+import sys
+import time
+from itertools import islice
+
+import pyarrow as pa
+import pyarrow.parquet as pq
 from dotenv import load_dotenv
 
-# Load .env file
-load_dotenv("./.env")
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from ingestion.goodreads_schema import GOODREADS_SCHEMA, conform_record
+from ingestion.s3_multipart import S3MultipartWriter
 
 
-# Get AWS credentials from environment variables
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-AWS_DEFAULT_REGION = os.getenv("AWS_REGION")
-S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
+DATASET_NAME = "BrightData/Goodreads-Books"
+S3_RAW_DATA_PATH = "raw/goodreads-books-2024-03-14"  # Extension added per format and compression
+FORMATS = ("jsonl", "parquet")
+COMPRESSIONS = {"zstd": ".zst", "gzip": ".gz", None: ""}
 
-S3_RAW_DATA_PATH = "raw/goodreads-books-2024-03-14.jsonl"
 
+def make_s3_client(env_path="./.env"):
+    """S3 client from the credentials in env_path; S3_ENDPOINT_URL points it at a local stand-in."""
+    load_dotenv(env_path)
+    return boto3.client("s3",
+                        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+                        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+                        region_name=os.getenv("AWS_REGION"),
+                        endpoint_url=os.getenv("S3_ENDPOINT_URL"))
 
-# Initialize S3 client with credentials from environment variables
-s3_client = boto3.client("s3", 
-                  aws_access_key_id=AWS_ACCESS_KEY_ID,
-                  aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-                  region_name=AWS_DEFAULT_REGION)
 
+def stream_goodreads(split="train"):
+    """Records of the Goodreads dataset, streamed without downloading it first."""
+    from datasets import load_dataset  # Only needed when ingesting from the hub
 
-dataset = load_dataset("BrightData/Goodreads-Books", split="train", streaming=True)
+    return load_dataset(DATASET_NAME, split=split, streaming=True)
 
 
-# Temporary local file to write the data before uploading
-with open("./temp.jsonl", "w") as f:
-    for i, book in enumerate(dataset):
-        f.write(json.dumps(book) + "\n")
-        if i >= 100000:  
-            break
+def raw_data_key(fmt="jsonl", compression="zstd") -> str:
+    """S3 key of the raw dump; transform_to_parquet picks the reader and codec from the suffix."""
+    if fmt == "parquet":
+        return f"{S3_RAW_DATA_PATH}.parquet"  # Parquet compresses its own pages
+    return f"{S3_RAW_DATA_PATH}.jsonl{COMPRESSIONS[compression]}"
 
 
-def upload_to_s3(local_file_path, s3_bucket_name, s3_file_path):
-    print(f"Uploading to s3 bucket - {s3_bucket_name}/{s3_file_path}")
-    try:
-        # Upload file to S3
-        s3_client.upload_file(local_file_path, s3_bucket_name, s3_file_path)
-        print(f"    File uploaded to s3://{s3_bucket_name}/{s3_file_path}")
-    except FileNotFoundError:
-        print(f"    The file {local_file_path} was not found.")
-    except Exception as e:
-        print(f"    Error uploading file: {e}")
+def ingest_to_s3(records, s3_client, bucket: str, key: str, fmt="jsonl", compression="zstd", max_records=100000,
+                 part_size=16 * 1024 * 1024, max_concurrency=4, batch_records=1000, report_every=10000,
+                 schema=GOODREADS_SCHEMA) -> dict:
+    """
+    Stream records straight into an S3 object, no local file involved.
+    Records are serialized batch by batch into compressed JSONL or Parquet, and each
+    part_size bytes of output are uploaded as a multipart part in the background, so
+    fetching, encoding and uploading overlap. Memory stays around one batch plus the
+    parts in flight.
+    :param records: iterable of dicts, e.g. stream_goodreads()
+    :param fmt: "jsonl" or "parquet"; Parquet is written with GOODREADS_SCHEMA, pass schema for other records.
+                Parquet records are converted to the schema first (see conform_record); ones that
+                cannot be are skipped and counted as rejected
+    :param compression: "zstd", "gzip" or None for JSONL; the page codec for Parquet
+    :param max_records: stop after this many records, None for all
+    :param batch_records: records encoded together; also the Parquet row group size
+    :param report_every: print throughput every this many records
+    :return: records, rejected records, raw and uploaded bytes, parts and throughput
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt}, expected one of {FORMATS}")
+    records = iter(records) if max_records is None else islice(records, max_records)
+    started = time.perf_counter()
+    count, rejected, raw_bytes = 0, 0, 0
+
+    def report(final=False):
+        seconds = time.perf_counter() - started
+        uploaded = sink.stats()["bytes"]
+        print(f"{'Ingested' if final else '    '} {count} records, {raw_bytes / 1e6:.1f} MB raw, "
+              f"{uploaded / 1e6:.1f} MB written in {seconds:.1f}s "
+              f"({count / seconds if seconds else 0.0:.0f} records/s, {uploaded / 1e6 / seconds if seconds else 0.0:.2f} MB/s)")
+
+    print(f"Streaming records to s3://{bucket}/{key}")
+    with S3MultipartWriter(s3_client, bucket, key, part_size=part_size, max_concurrency=max_concurrency) as sink:
+        out = pa.CompressedOutputStream(sink, compression) if fmt == "jsonl" and compression else sink
+        writer = None  # Parquet writer, created with the first batch
+        while True:
+            batch = list(islice(records, batch_records))
+            if not batch:
+                break
+            if fmt == "jsonl":
+                data = "".join(json.dumps(record) + "\n" for record in batch).encode("utf-8")
+                raw_bytes += len(data)
+                out.write(data)
+            else:
+                # An explicit schema: a column that is all null in one batch keeps its type.
+                # from_pylist does not coerce, so values are converted to it first
+                rows = []
+                for record in batch:
+                    try:
+                        rows.append(conform_record(record, schema))
+                    except ValueError as e:
+                        if not rejected:
+                            print(f"    Skipping records that do not match the schema, first: {e}")
+                        rejected += 1
+                table = pa.Table.from_pylist(rows, schema=schema)
+                if writer is None:
+                    writer = pq.ParquetWriter(sink, schema, compression=compression or "none")
+                raw_bytes += table.nbytes
+                writer.write_table(table, row_group_size=batch_records)
+            previous, count = count, count + len(batch)
+            if report_every and count // report_every > previous // report_every:
+                report()
 
+        # Only reached without errors; on an error the sink aborts the upload instead
+        if writer is not None:
+            writer.close()  # Writes the footer
+        if out is not sink:
+            out.close()  # Flushes the codec, and closes the sink with it, completing the upload
+    report(final=True)
+    seconds = time.perf_counter() - started
+    return {"records": count, "rejected": rejected, "raw_bytes": raw_bytes, **sink.stats(),
+            "records_per_sec": count / seconds if seconds else 0.0}
 
 
-local_file_path = './temp.jsonl'
-upload_to_s3(local_file_path, S3_BUCKET_NAME, S3_RAW_DATA_PATH)
\ No newline at end of file
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Stream the Goodreads dataset into S3.")
+    parser.add_argument("--max-records", type=int, default=100000)
+    parser.add_argument("--format", choices=FORMATS, default="jsonl")
+    parser.add_argument("--compression", choices=["zstd", "gzip", "none"], default="zstd")
+    parser.add_argument("--part-size-mb", type=int, default=16)
+    parser.add_argument("--upload-threads", type=int, default=4)
+    args = parser.parse_args()
+
+    compression = None if args.compression == "none" else args.compression
+    s3_client = make_s3_client()
+    key = raw_data_key(args.format, compression)
+    try:
+        stats = ingest_to_s3(stream_goodreads(), s3_client, os.getenv("S3_BUCKET_NAME"), key, fmt=args.format,
+                             compression=compression, max_records=args.max_records,
+                             part_size=args.part_size_mb * 1024 * 1024, max_concurrency=args.upload_threads)
+        print(f"    File uploaded to s3://{os.getenv('S3_BUCKET_NAME')}/{key}: {stats}")
+    except Exception as e:
+        print(f"    Error uploading records: {e}")
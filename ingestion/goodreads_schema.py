@@ -0,0 +1,81 @@
+import json
+import math
+
+import pyarrow as pa
+
+
+# Type of every star bucket in community_reviews
+_REVIEW_BUCKET = pa.struct([("reviews_num", pa.float64()), ("reviews_percentage", pa.float64())])
+
+# Records of the Goodreads dataset, as fetched by fetch_goodreads.py and parsed by transform_to_parquet.py.
+# Numbers are float64 so integral and fractional JSON values both parse, and missing ones become NaN
+# in pandas as before. Nested objects keep the listed keys; others are dropped.
+GOODREADS_SCHEMA = pa.schema([
+    ("url", pa.string()),
+    ("id", pa.string()),
+    ("name", pa.string()),
+    ("author", pa.string()),
+    ("star_rating", pa.float64()),
+    ("num_ratings", pa.float64()),
+    ("num_reviews", pa.float64()),
+    ("summary", pa.string()),
+    ("genres", pa.list_(pa.string())),
+    ("first_published", pa.string()),
+    ("about_author", pa.struct([("name", pa.string()), ("num_books", pa.float64()),
+                                ("num_followers", pa.float64())])),
+    ("community_reviews", pa.struct([(bucket, _REVIEW_BUCKET)
+                                     for bucket in ("5_stars", "4_stars", "3_stars", "2_stars", "1_star")])),
+    ("kindle_price", pa.float64()),
+])
+
+
+def _conform(value, type_: pa.DataType):
+    """Value converted to type_ where that loses nothing: numbers from numeric strings and back,
+    a bare item as a one item list, nested objects from JSON strings. ValueError otherwise."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if pa.types.is_string(type_) or pa.types.is_large_string(type_):
+        if isinstance(value, (dict, list)):
+            return json.dumps(value)
+        return str(value)
+    if pa.types.is_floating(type_) or pa.types.is_integer(type_):
+        if isinstance(value, bool):
+            raise ValueError(f"boolean {value} where a number is expected")
+        if isinstance(value, str):
+            value = value.strip().lstrip("$").replace(",", "")
+            if not value:
+                return None
+        number = float(value)  # ValueError or TypeError for anything that is not a number
+        if pa.types.is_floating(type_):
+            return number
+        if not number.is_integer():
+            raise ValueError(f"{value} is not an integer")
+        return int(number)
+    if pa.types.is_list(type_) or pa.types.is_large_list(type_):
+        items = value if isinstance(value, (list, tuple)) else [value]
+        return [_conform(item, type_.value_type) for item in items]
+    if pa.types.is_struct(type_):
+        if isinstance(value, str):
+            value = json.loads(value)
+        if not isinstance(value, dict):
+            raise ValueError(f"{type(value).__name__} where an object is expected")
+        return {field.name: _conform(value.get(field.name), field.type) for field in type_}
+    return value
+
+
+def conform_record(record, schema: pa.Schema = GOODREADS_SCHEMA) -> dict:
+    """
+    Record with the fields of schema, each converted to its type, so pyarrow accepts it
+    (pyarrow does not coerce: an int id or a quoted rating fails a whole batch).
+    Fields outside the schema are dropped and missing ones are null.
+    :raises ValueError: for a value that cannot be converted, e.g. a word where a number is expected
+    """
+    if not isinstance(record, dict):
+        raise ValueError(f"{type(record).__name__} where a record object is expected")
+    conformed = {}
+    for field in schema:
+        try:
+            conformed[field.name] = _conform(record.get(field.name), field.type)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"{field.name}: {e}") from None
+    return conformed
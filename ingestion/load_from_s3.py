@@ -1,17 +1,118 @@
 import pandas as pd
 import boto3
-from io import BytesIO
+import io
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+import pyarrow.parquet as pq
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError, ClientError
 from dotenv import load_dotenv
 import os
 
 
+DEFAULT_CACHE_DIR = os.getenv("S3_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "document-llm", "s3"))
+FOOTER_PREFETCH_BYTES = 64 * 1024  # Tail fetched up front; covers the footer of most files in one GET
+RANGE_REQUEST_BYTES = 8 * 1024 * 1024  # Column chunks larger than this are fetched as several concurrent GETs
+
+
+class S3RangeFile(io.RawIOBase):
+    """
+    Seekable read-only file over an S3 object, backed by ranged GETs.
+    Byte ranges announced with prefetch() are downloaded concurrently ahead of time and
+    served from memory; any other read becomes a ranged GET of its own.
+    """
+
+    def __init__(self, s3_client, bucket: str, key: str, size: int, executor: ThreadPoolExecutor):
+        super().__init__()
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.executor = executor
+        self.requests = 0
+        self.bytes_fetched = 0
+        self._position = 0
+        self._ranges = {}  # start -> (length, future of the bytes)
+        self._lock = threading.Lock()
+        tail = max(0, size - FOOTER_PREFETCH_BYTES)
+        self.prefetch([(tail, size - tail)])
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self.size}[whence]
+        self._position = base + offset
+        return self._position
+
+    def get_range(self, start: int, length: int) -> bytes:
+        response = self.s3.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{start + length - 1}")
+        data = response["Body"].read()
+        with self._lock:
+            self.requests += 1
+            self.bytes_fetched += len(data)
+        return data
+
+    def prefetch(self, ranges):
+        """Start downloading (start, length) ranges in the background, split into RANGE_REQUEST_BYTES pieces."""
+        with self._lock:
+            for start, length in ranges:
+                for piece in range(start, start + length, RANGE_REQUEST_BYTES):
+                    if piece not in self._ranges:
+                        piece_length = min(RANGE_REQUEST_BYTES, start + length - piece)
+                        self._ranges[piece] = (piece_length, self.executor.submit(self.get_range, piece, piece_length))
+
+    def release(self, ranges):
+        """Forget prefetched ranges that have been read."""
+        with self._lock:
+            for start, length in ranges:
+                for piece in range(start, start + length, RANGE_REQUEST_BYTES):
+                    self._ranges.pop(piece, None)
+
+    def _cached(self, start: int, length: int):
+        """Bytes of the range from prefetched pieces, waiting for pieces still downloading; None on a gap."""
+        with self._lock:
+            pieces = list(self._ranges.items())
+        chunks = []
+        position, end = start, start + length
+        while position < end:
+            match = next(((piece_start, future) for piece_start, (piece_length, future) in pieces
+                          if piece_start <= position < piece_start + piece_length), None)
+            if match is None:
+                return None
+            piece_start, future = match
+            chunk = future.result()[position - piece_start:end - piece_start]
+            if not chunk:
+                return None
+            chunks.append(chunk)
+            position += len(chunk)
+        return b"".join(chunks)
+
+    def readinto(self, buffer):
+        length = min(len(buffer), self.size - self._position)
+        if length <= 0:
+            return 0
+        data = self._cached(self._position, length)
+        if data is None:
+            data = self.get_range(self._position, length)
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
 
 
 class S3DataFetcher:
-    def __init__(self, env_path = './.env'):
+    def __init__(self, env_path = './.env', cache_dir=DEFAULT_CACHE_DIR):
         """
         Initialize S3DataFetcher with S3 client using environment variables.
+        :param cache_dir: local copies of downloaded objects, one file per bucket, key and ETag;
+                          None always reads from S3
         """
         # Load environment variables from .env file
         load_dotenv(env_path)
@@ -29,8 +130,10 @@ class S3DataFetcher:
             's3',
             aws_access_key_id=self.aws_access_key,
             aws_secret_access_key=self.aws_secret_key,
-            region_name=self.aws_region
+            region_name=self.aws_region,
+            endpoint_url=os.getenv("S3_ENDPOINT_URL"),  # Local S3 stand-in; unset for AWS
         )
+        self.cache_dir = cache_dir
 
     def check_connection(self):
         """
@@ -75,31 +178,142 @@ class S3DataFetcher:
             print(f"Error: File '{self.file_key}' does not exist in the bucket. {e}")
             return False
 
-    def fetch_parquet_from_s3(self):
+    def iter_parquet_batches(self, columns=None, batch_size=None, as_pandas=False, max_concurrency=8):
+        """
+        Stream the Parquet file row group by row group, reading only the requested columns.
+        Only the footer and the column chunks of the selected columns are downloaded, with
+        concurrent ranged GETs; the next row group is fetched while the current one is being
+        consumed, so memory stays around two row groups of the selected columns.
+        :param columns: top-level columns to read, None for all
+        :param batch_size: split each row group into batches of at most this many rows
+        :param as_pandas: yield DataFrames instead of Arrow record batches
+        """
+        head = self.s3_client.head_object(Bucket=self.bucket_name, Key=self.file_key)
+        cached = self.cached_path(head)
+        if cached is not None and os.path.exists(cached):
+            # Unchanged since it was cached: read the local copy memory-mapped, nothing is downloaded
+            for batch in pq.ParquetFile(cached, memory_map=True).iter_batches(batch_size=batch_size or 65536,
+                                                                              columns=columns):
+                yield batch.to_pandas() if as_pandas else batch
+            return
+
+        size = head["ContentLength"]
+        with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="s3-range-get") as executor:
+            source = S3RangeFile(self.s3_client, self.bucket_name, self.file_key, size, executor)
+            parquet_file = pq.ParquetFile(pa.PythonFile(source, mode="r"))
+            wanted = set(columns) if columns is not None else None
+
+            def chunk_ranges(row_group):
+                metadata = parquet_file.metadata.row_group(row_group)
+                ranges = []
+                for i in range(metadata.num_columns):
+                    column = metadata.column(i)
+                    if wanted is not None and column.path_in_schema.split(".")[0] not in wanted:
+                        continue
+                    start = column.data_page_offset
+                    if column.has_dictionary_page and column.dictionary_page_offset:
+                        start = min(start, column.dictionary_page_offset)
+                    ranges.append((start, column.total_compressed_size))
+                return ranges
+
+            num_row_groups = parquet_file.num_row_groups
+            if num_row_groups:
+                source.prefetch(chunk_ranges(0))
+            for row_group in range(num_row_groups):
+                if row_group + 1 < num_row_groups:
+                    source.prefetch(chunk_ranges(row_group + 1))  # Overlaps the download with consumption
+                table = parquet_file.read_row_group(row_group, columns=columns)
+                source.release(chunk_ranges(row_group))
+                for batch in table.to_batches(max_chunksize=batch_size):
+                    yield batch.to_pandas() if as_pandas else batch
+            print(f"Read {self.file_key}: {source.requests} range requests, "
+                  f"{source.bytes_fetched / 1e6:.1f} of {size / 1e6:.1f} MB")
+
+    def cached_path(self, head: dict):
+        """Local path of the object version described by a head_object response, None without a cache."""
+        if self.cache_dir is None:
+            return None
+        etag = head["ETag"].strip('"').replace("/", "_")
+        return os.path.join(self.cache_dir, self.bucket_name, self.file_key, etag)
+
+    def download_to_cache(self, head: dict, max_concurrency=8) -> str:
+        """
+        Download the object version in head into the cache with concurrent ranged GETs.
+        Every range is conditional on the ETag, so an object replaced mid-download fails
+        the download instead of leaving a mixed file. Older versions of the key are removed.
+        :return: path of the cached file
+        """
+        path = self.cached_path(head)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        size = head["ContentLength"]
+
+        def fetch(start):
+            length = min(RANGE_REQUEST_BYTES, size - start)
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self.file_key, IfMatch=head["ETag"],
+                                                 Range=f"bytes={start}-{start + length - 1}")
+            os.pwrite(fd, response["Body"].read(), start)
+
+        # A temp file of its own, so concurrent downloads of the same version never share an inode
+        fd, partial = tempfile.mkstemp(dir=directory, prefix=f"{os.path.basename(path)}.", suffix=".part")
+        try:
+            try:
+                os.ftruncate(fd, size)
+                with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="s3-range-get") as executor:
+                    list(executor.map(fetch, range(0, size, RANGE_REQUEST_BYTES)))  # Re-raises a failed range
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            os.chmod(partial, 0o644)
+            os.replace(partial, path)  # Readers only ever see complete files; the last finished copy wins
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+
+        for name in os.listdir(directory):
+            if name != os.path.basename(path) and not name.endswith(".part"):
+                try:
+                    os.remove(os.path.join(directory, name))  # Superseded version of the key
+                except FileNotFoundError:
+                    pass  # Removed by a concurrent download
+        return path
+
+    def fetch_parquet_from_s3(self, columns=None):
         """
         Fetch Parquet file from S3 and load it into a Pandas DataFrame.
+        A single head_object compares the object's ETag with the local cache: a cached copy
+        is read memory-mapped, otherwise the file is first downloaded with parallel ranged GETs.
+        Without a cache only the requested columns are downloaded, see iter_parquet_batches.
+        :param columns: read only these columns
         :return: Pandas DataFrame containing the data from the Parquet file
         """
-
-        # Check AWS connection first
-        if not self.check_connection():
+        # One request doubles as the credentials, bucket and file check
+        try:
+            head = self.s3_client.head_object(Bucket=self.bucket_name, Key=self.file_key)
+        except NoCredentialsError:
+            print("Error: AWS credentials are not provided or are invalid.")
             return None
-        # Check if the bucket exists
-        if not self.check_bucket_exists():
+        except PartialCredentialsError:
+            print("Error: AWS credentials are partially incorrect or incomplete.")
             return None
-        # Check if the file exists in the bucket
-        if not self.check_file_exists():
+        except ClientError as e:
+            print(f"Error: File '{self.file_key}' in bucket '{self.bucket_name}' does not exist or is inaccessible. {e}")
             return None
-        
+
         try:
-            print(f"Downloading {self.file_key} from S3 bucket {self.bucket_name}...")
-            # Fetch the Parquet file from S3
-            obj = self.s3_client.get_object(Bucket=self.bucket_name, Key=self.file_key)
-            parquet_data = obj['Body'].read()
-            
-            # Use BytesIO to simulate file-like object and load it into a DataFrame
-            data = BytesIO(parquet_data)
-            df = pd.read_parquet(data)
+            path = self.cached_path(head)
+            if path is None:
+                print(f"Downloading {self.file_key} from S3 bucket {self.bucket_name}...")
+                batches = list(self.iter_parquet_batches(columns=columns))
+                df = pa.Table.from_batches(batches).to_pandas() if batches else pd.DataFrame(columns=columns)
+            else:
+                if os.path.exists(path):
+                    print(f"Using cached {self.file_key} (ETag {head['ETag']}) from {path}")
+                else:
+                    print(f"Downloading {self.file_key} from S3 bucket {self.bucket_name} to {path}...")
+                    self.download_to_cache(head)
+                df = pq.read_table(path, columns=columns, memory_map=True).to_pandas()
             print("Data successfully loaded from S3 into DataFrame.")
             return df
         except Exception as e:
@@ -0,0 +1,150 @@
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+MIN_PART_SIZE = 5 * 1024 * 1024  # S3 rejects smaller parts, except the last one
+
+
+class S3MultipartWriter(io.RawIOBase):
+    """
+    Writable file object that uploads to S3 while it is being written.
+    Every part_size bytes become one multipart part, uploaded by a thread pool with
+    at most max_concurrency parts in flight; a writer that gets ahead of the uploads
+    waits, so memory stays around (max_concurrency + 1) * part_size. An object that
+    never fills a part is sent with a single put_object on close.
+    Use it as a context manager: an exception aborts the upload instead of completing it.
+    """
+
+    def __init__(self, s3_client, bucket: str, key: str, part_size=16 * 1024 * 1024, max_concurrency=4,
+                 extra_args=None):
+        """
+        :param extra_args: passed to create_multipart_upload / put_object, e.g. {"Metadata": {...}}
+        """
+        super().__init__()
+        if part_size < MIN_PART_SIZE:
+            raise ValueError(f"part_size must be at least {MIN_PART_SIZE} bytes")
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+        self.extra_args = extra_args or {}
+
+        self.upload_id = None  # Created with the first full part
+        self.aborted = False
+        self._buffer = bytearray()
+        self._position = 0
+        self._in_flight = set()
+        self._parts = []
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="s3-part-upload")
+        self._started = time.perf_counter()
+        self.seconds = None
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def write(self, data):
+        if self.aborted:
+            return len(data)  # Encoders torn down after an error may still flush into us
+        if self.closed:
+            raise ValueError("write to a closed S3MultipartWriter")
+        self._buffer += data
+        self._position += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._submit(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    def _submit(self, data: bytes):
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                                             **self.extra_args)["UploadId"]
+        while len(self._in_flight) >= self.max_concurrency:
+            self._collect(wait(self._in_flight, return_when=FIRST_COMPLETED).done)
+        part_number = len(self._parts) + len(self._in_flight) + 1
+        self._in_flight.add(self._pool.submit(self._upload_part, part_number, data))
+
+    def _upload_part(self, part_number: int, data: bytes) -> dict:
+        response = self.s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                       PartNumber=part_number, Body=data)
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+    def _collect(self, done):
+        for future in done:
+            self._in_flight.discard(future)
+            self._parts.append(future.result())  # Re-raises a failed part upload
+
+    def close(self):
+        """Upload what is left and complete the object."""
+        if self.closed:
+            return
+        try:
+            if self.upload_id is None:
+                self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer), **self.extra_args)
+            else:
+                if self._buffer:
+                    self._submit(bytes(self._buffer))
+                self._collect(wait(self._in_flight).done)
+                self.s3.complete_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                    MultipartUpload={"Parts": sorted(self._parts, key=lambda part: part["PartNumber"])},
+                )
+            self._buffer = bytearray()
+            self.seconds = time.perf_counter() - self._started
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self._pool.shutdown(wait=True)
+            super().close()
+
+    def abort(self):
+        """Drop the upload; S3 keeps no partial object and later writes are discarded."""
+        self.aborted = True
+        wait(self._in_flight)
+        self._in_flight.clear()
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+        self._pool.shutdown(wait=True)
+        super().close()
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def stats(self) -> dict:
+        seconds = self.seconds if self.seconds is not None else time.perf_counter() - self._started
+        return {
+            "bytes": self._position,
+            "parts": len(self._parts) + len(self._in_flight),
+            "seconds": seconds,
+            "mb_per_sec": self._position / 1e6 / seconds if seconds else 0.0,
+        }
+
+
+class S3BodyReader(io.RawIOBase):
+    """Readable file object over a get_object Body, so readers can pull it incrementally."""
+
+    def __init__(self, body):
+        super().__init__()
+        self.body = body
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.body.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.body.close()
+        super().close()
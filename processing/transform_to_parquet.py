@@ -1,12 +1,21 @@
 import os
+import sys
+import io
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 import boto3
-import pandas as pd
+import pyarrow as pa
+import pyarrow.json as pj
 import pyarrow.parquet as pq
-import json
-from io import BytesIO
 from dotenv import load_dotenv
 from botocore.exceptions import NoCredentialsError, ClientError
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from ingestion.goodreads_schema import GOODREADS_SCHEMA, conform_record
+from ingestion.load_from_s3 import S3RangeFile
+from ingestion.s3_multipart import S3MultipartWriter, S3BodyReader
+
 # Load AWS credentials
 load_dotenv("../ingestion/fetch_goodreads/.env")
 
@@ -17,51 +26,193 @@ s3_client = boto3.client(
     "s3",
     aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
     aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-    region_name=os.getenv("AWS_REGION")
+    region_name=os.getenv("AWS_REGION"),
+    endpoint_url=os.getenv("S3_ENDPOINT_URL"),  # Local S3 stand-in (MinIO, moto server); unset for AWS
 )
 
-RAW_DATA_PATH = "raw/goodreads-books-2024-03-14.jsonl"  # Raw JSONL file
+RAW_DATA_PATH = "raw/goodreads-books-2024-03-14.jsonl.zst"  # Raw dump, as written by ingestion/fetch_goodreads.py
 PROCESSED_DATA_PATH = "processed/goodreads-books-2024-03-14.parquet"
 
-def load_jsonl_from_s3():
-    """Load raw JSONL data from S3 into a DataFrame."""
-    try:
-        response = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=RAW_DATA_PATH)
-        jsonl_data = response["Body"].read().decode("utf-8").splitlines()
-        data = [json.loads(line) for line in jsonl_data] #Convert list of dicts to dataframe
-        return pd.DataFrame(data)
-    except ClientError as e:
-        print(f"Error loading JSONL from S3: {e}")
-        return None
-    except Exception as e:
-        print(f"Unexpected error: {e}")
-        return None
+# Key suffix -> Arrow codec of compressed raw objects
+COMPRESSIONS = {".gz": "gzip", ".zst": "zstd"}
+
+
+def open_jsonl_stream(s3, bucket: str, key: str, buffer_size=1024 * 1024) -> pa.NativeFile:
+    """Incremental, decompressed stream over a JSONL object; nothing is read up front."""
+    body = s3.get_object(Bucket=bucket, Key=key)["Body"]
+    stream = pa.PythonFile(io.BufferedReader(S3BodyReader(body), buffer_size), mode="r")
+    codec = next((codec for suffix, codec in COMPRESSIONS.items() if key.endswith(suffix)), None)
+    return pa.CompressedInputStream(stream, codec) if codec else stream
+
+
+def infer_jsonl_schema(s3, bucket: str, key: str, sample_bytes=8 * 1024 * 1024) -> pa.Schema:
+    """
+    Schema of the records in the first sample_bytes of the object.
+    Columns that are null throughout the sample are typed as strings. Only for data
+    without a known schema: a later record whose types differ fails the transform.
+    """
+    with open_jsonl_stream(s3, bucket, key) as stream:
+        sample = stream.read(sample_bytes)
+    if len(sample) == sample_bytes:
+        sample = sample[:sample.rfind(b"\n") + 1]  # Whole lines only
+    schema = pj.read_json(pa.BufferReader(sample)).schema
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            schema = schema.set(i, field.with_type(pa.string()))
+    return schema
+
+
+def conform_rows(rows: list, schema: pa.Schema, rejects: list) -> pa.RecordBatch:
+    """
+    Record batch of the rows that conform_record can convert to schema.
+    The others are appended to rejects as JSON lines, with the reason.
+    """
+    conformed = []
+    for row in rows:
+        try:
+            conformed.append(conform_record(row, schema))
+        except ValueError as e:
+            rejects.append(json.dumps({"error": str(e), "record": row}, default=str))
+    return pa.RecordBatch.from_pylist(conformed, schema=schema)
+
 
+def iter_jsonl_batches(stream, schema: pa.Schema, rejects: list, block_size=4 * 1024 * 1024):
+    """
+    Record batches of a JSONL stream, block_size bytes of whole lines at a time.
+    Each block is parsed by pyarrow's JSON reader against schema; a block it refuses
+    (a number where a string is expected, a quoted number, a bare string for a list)
+    is parsed again line by line with conform_record, so one odd record costs one
+    slow block instead of the job. Lines that still do not fit go to rejects.
+    The stream is closed when the iterator ends.
+    """
+    parse_options = pj.ParseOptions(explicit_schema=schema, unexpected_field_behavior="ignore")
+    rest = b""
+    while True:
+        chunk = stream.read(block_size)
+        if not chunk:
+            stream.close()
+        block = rest + chunk
+        end = block.rfind(b"\n") + 1 if chunk else len(block)
+        block, rest = block[:end], block[end:]
+        if block.strip():
+            try:
+                batches = pj.read_json(pa.BufferReader(block), read_options=pj.ReadOptions(block_size=len(block)),
+                                       parse_options=parse_options).to_batches()
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                rows = []
+                for line in block.splitlines():
+                    if not line.strip():
+                        continue
+                    try:
+                        rows.append(json.loads(line))
+                    except ValueError as e:
+                        rejects.append(json.dumps({"error": f"invalid JSON: {e}", "line": line.decode("utf-8", "replace")}))
+                batches = [conform_rows(rows, schema, rejects)]
+            yield from batches
+        if not chunk:
+            break
 
-def save_parquet_to_s3(df):
-    """Convert DataFrame to Parquet and upload to S3."""
+
+def open_parquet_batches(s3, bucket: str, key: str, schema=None, max_concurrency=4, rejects=None):
+    """
+    Record batches of a raw Parquet dump (fetch_goodreads.py --format parquet), read with ranged GETs.
+    :param schema: batches are conformed to it, missing columns become null; None keeps the file's schema
+    :param rejects: list that rows which cannot be cast to schema are appended to, see conform_rows;
+                    None raises on them instead
+    :return: (schema, iterator of record batches)
+    """
+    size = s3.head_object(Bucket=bucket, Key=key)["ContentLength"]
+    executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="s3-range-get")
+    parquet_file = pq.ParquetFile(pa.PythonFile(S3RangeFile(s3, bucket, key, size, executor), mode="r"))
+    schema = schema if schema is not None else parquet_file.schema_arrow
+
+    def batches():
+        try:
+            for batch in parquet_file.iter_batches():
+                try:
+                    columns = [batch.column(field.name).cast(field.type) if field.name in batch.schema.names
+                               else pa.nulls(batch.num_rows, field.type) for field in schema]
+                    yield pa.RecordBatch.from_arrays(columns, schema=schema)
+                except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                    if rejects is None:
+                        raise
+                    yield conform_rows(batch.to_pylist(), schema, rejects)
+        finally:
+            executor.shutdown(wait=True)
+
+    return schema, batches()
+
+
+def stream_jsonl_to_parquet(s3=s3_client, bucket=S3_BUCKET_NAME, source_key=RAW_DATA_PATH,
+                            dest_key=PROCESSED_DATA_PATH, schema=GOODREADS_SCHEMA, row_group_size=50000,
+                            block_size=4 * 1024 * 1024, part_size=16 * 1024 * 1024, max_concurrency=4,
+                            compression="snappy", reject_key=None) -> dict:
+    """
+    Convert a JSONL object to a Parquet object without holding the dataset in memory.
+    A source key ending in .parquet is read as a raw Parquet dump instead, and rewritten
+    with the processed row groups, schema and compression.
+    The body is parsed block by block against a fixed schema (see iter_jsonl_batches),
+    written out in row groups of row_group_size rows and uploaded in multipart parts
+    as the Parquet file grows. Peak memory is about one row group plus the parts in flight.
+    Records that cannot be converted to the schema are skipped and written to reject_key.
+    :param schema: explicit schema of the records, fields outside it are dropped; None pins the
+                   one inferred from the start of the object, see infer_jsonl_schema
+    :param block_size: bytes of JSON parsed per record batch
+    :param part_size: bytes per multipart part, at least 5 MiB
+    :param reject_key: JSONL object of the skipped records and why, defaults to dest_key + ".rejects.jsonl";
+                       only written when there are any
+    :return: rows, rejected rows, row groups, bytes and timing of the transform
+    """
+    started = time.perf_counter()
+    rejects = []
+    if source_key.endswith(".parquet"):
+        schema, reader = open_parquet_batches(s3, bucket, source_key, schema, rejects=rejects)
+    else:
+        if schema is None:
+            schema = infer_jsonl_schema(s3, bucket, source_key)
+        reader = iter_jsonl_batches(open_jsonl_stream(s3, bucket, source_key), schema, rejects, block_size)
+    rows, row_groups = 0, 0
+    pending, pending_rows = [], 0
+    with S3MultipartWriter(s3, bucket, dest_key, part_size=part_size, max_concurrency=max_concurrency,
+                           extra_args={"Metadata": {"status": "processed"}}) as sink:
+        with pq.ParquetWriter(sink, schema, compression=compression) as writer:
+            for batch in reader:
+                pending.append(batch)
+                pending_rows += batch.num_rows
+                while pending_rows >= row_group_size:
+                    table = pa.Table.from_batches(pending, schema=schema)
+                    writer.write_table(table.slice(0, row_group_size), row_group_size=row_group_size)
+                    rest = table.slice(row_group_size)
+                    pending, pending_rows = rest.to_batches(), rest.num_rows
+                    rows += row_group_size
+                    row_groups += 1
+            if pending_rows:
+                writer.write_table(pa.Table.from_batches(pending, schema=schema), row_group_size=row_group_size)
+                rows += pending_rows
+                row_groups += 1
+    if rejects:
+        reject_key = reject_key or f"{dest_key}.rejects.jsonl"
+        s3.put_object(Bucket=bucket, Key=reject_key, Body="".join(line + "\n" for line in rejects).encode("utf-8"))
+        print(f"Skipped {len(rejects)} records that do not match the schema, see s3://{bucket}/{reject_key}")
+    seconds = time.perf_counter() - started
+    return {"rows": rows, "rejected": len(rejects), "row_groups": row_groups, "parquet_bytes": sink.stats()["bytes"],
+            "parts": sink.stats()["parts"], "seconds": seconds, "rows_per_sec": rows / seconds if seconds else 0.0}
+
+
+def main():
+    print(f"Streaming s3://{S3_BUCKET_NAME}/{RAW_DATA_PATH} to Parquet...")
     try:
-        buffer = BytesIO()
-        df.to_parquet(buffer, engine="pyarrow", compression="snappy")
-        buffer.seek(0)
-        
-        s3_client.upload_fileobj(buffer, S3_BUCKET_NAME, PROCESSED_DATA_PATH, ExtraArgs={"Metadata": {"status": "processed"}})
-        print(f"Processed data uploaded to s3://{S3_BUCKET_NAME}/{PROCESSED_DATA_PATH}")
+        stats = stream_jsonl_to_parquet()
+        print(f"Processed data uploaded to s3://{S3_BUCKET_NAME}/{PROCESSED_DATA_PATH}: {stats}")
+        print("Data transformation complete!")
     except NoCredentialsError:
         print("AWS credentials not available.")
     except ClientError as e:
-        print(f"Error uploading Parquet to S3: {e}")
+        print(f"Error transforming data in S3: {e}")
+    except pa.ArrowInvalid as e:
+        print(f"Raw records do not match the schema: {e}")
     except Exception as e:
         print(f"Unexpected error: {e}")
 
-def main():
-    print("Loading raw data from S3...")
-    df = load_jsonl_from_s3()
-
-    if df is not None:
-        print(f"Loaded {len(df)} records. Transforming to Parquet...")
-        save_parquet_to_s3(df)
-        print("Data transformation complete!")
-
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,149 +1,586 @@
 import sys
 import os
+import argparse
+import json
+import hashlib
+import queue
+import threading
+from collections import Counter, deque
 from elasticsearch import Elasticsearch
-from elasticsearch.exceptions import RequestError, ConnectionError
+from elasticsearch.exceptions import RequestError, ConnectionError, NotFoundError
 from tqdm import tqdm
 import logging
+import pandas as pd
 import torch
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from indexing.preprocessing import DataPreprocessor
-from indexing.embedding import EmbeddingModel
+from indexing.preprocessing import DataPreprocessor, flatten_chunks
+from indexing.embedding import DEFAULT_BACKEND, DEFAULT_MODEL_NAME, quantize_int8
+from indexing.model_registry import get_embedding_model
+from indexing.manifest import IndexManifest
+from indexing.embedding_cache import EmbeddingCache
+from indexing.embedding_pool import EmbeddingWorkerPool
+from indexing.elasticsearch_idx import ElasticsearchVectorStore, books_index_name
+from indexing.local_store import LocalVectorStore, LocalVectorStoreWriter
 
 from ingestion.load_from_s3 import S3DataFetcher
 
-from elasticsearch.helpers import bulk, BulkIndexError
+from elasticsearch.helpers import streaming_bulk, parallel_bulk, BulkIndexError
 import traceback
 
 
+_END_OF_BATCHES = object()  # Sentinel the embedding thread puts on the queue when it is done
+
+# Row fields that make up a book's content hash; a change in any of them re-indexes the book
+HASHED_FIELDS = ["summary", "url", "name", "author", "star_rating", "num_ratings", "num_reviews",
+                 "genres", "first_published", "about_author", "community_reviews", "kindle_price"]
+# Compact layout: fields kept on each chunk so the retriever can pre-filter kNN, and fields stored once per book
+CHUNK_FILTER_FIELDS = ["star_rating", "genres", "first_published", "kindle_price"]
+BOOK_FIELDS = ["url", "name", "author", "star_rating", "num_ratings", "num_reviews", "genres",
+               "first_published", "about_author", "community_reviews", "kindle_price"]
+
+
 class GoodreadsIndexer():
-    def __init__(self, es_client, index_name):
+    def __init__(self, es_client, index_name, embedding_batch_size=64, rows_per_batch=256,
+                 queue_size=4, bulk_chunk_size=500, bulk_threads=1, manifest_path=None,
+                 embedding_cache_dir=None, embedding_cache_max_entries=None, embedding_workers=0,
+                 threads_per_worker=None, embedding_backend=DEFAULT_BACKEND, chunk_tokens=None,
+                 chunk_overlap_tokens=32, preprocess_workers=0, vector_storage="float", layout="full"):
+        """
+        :param embedding_batch_size: texts per model forward pass
+        :param rows_per_batch: DataFrame rows preprocessed and embedded together
+        :param queue_size: embedded row batches allowed to wait for ES; bounds memory and applies backpressure
+        :param bulk_chunk_size: actions per bulk request
+        :param bulk_threads: >1 sends bulk requests with parallel_bulk
+        :param manifest_path: enables incremental mode; unchanged books are skipped and
+                              progress is checkpointed to this file
+        :param embedding_cache_dir: reuse chunk embeddings from earlier runs stored in this directory
+        :param embedding_cache_max_entries: size bound of the embedding cache, in vectors
+        :param embedding_workers: >0 embeds in that many worker processes instead of this one
+        :param threads_per_worker: torch threads per worker, defaults to cpu_count // embedding_workers
+        :param embedding_backend: "eager", "int8" or "onnx", see EmbeddingModel
+        :param chunk_tokens: chunk summaries by this many model tokens instead of 512 characters
+        :param chunk_overlap_tokens: tokens shared by consecutive chunks in token mode
+        :param preprocess_workers: processes for sentence splitting in character mode
+        :param vector_storage: must match the index mapping; "byte" sends int8 vectors
+        :param layout: "compact" writes book metadata once to the books index instead of into every chunk
+        """
         self.es_client = es_client
         self.index_name = index_name
-        self.preprocessor = DataPreprocessor()  # 512 chunks
-        self.embeddings_obj = EmbeddingModel()
+        if chunk_tokens:
+            self.preprocessor = DataPreprocessor(tokenizer_name=DEFAULT_MODEL_NAME, chunk_tokens=chunk_tokens,
+                                                 overlap_tokens=chunk_overlap_tokens)
+        else:
+            self.preprocessor = DataPreprocessor(num_workers=preprocess_workers)  # 512 chunks
+        if embedding_workers > 0:
+            self.embeddings_obj = EmbeddingWorkerPool(num_workers=embedding_workers,
+                                                      threads_per_worker=threads_per_worker,
+                                                      batch_size=embedding_batch_size,
+                                                      backend=embedding_backend)
+        else:
+            # Shared with any retriever in this process
+            self.embeddings_obj = get_embedding_model(backend=embedding_backend)
+        self.embedding_batch_size = embedding_batch_size
+        self.rows_per_batch = rows_per_batch
+        self.queue_size = queue_size
+        self.bulk_chunk_size = bulk_chunk_size
+        self.bulk_threads = bulk_threads
+        self.vector_storage = vector_storage
+        self.layout = layout
+        self.books_index = books_index_name(index_name)
+        self.manifest = IndexManifest(manifest_path) if manifest_path else None
+        self.embedding_cache = None
+        if embedding_cache_dir:
+            self.embedding_cache = EmbeddingCache(embedding_cache_dir, self.embeddings_obj.model_name,
+                                                  config={**self.preprocessor.get_config(),
+                                                          "backend": self.embeddings_obj.backend},
+                                                  max_entries=embedding_cache_max_entries)
 
-    def prepare_documents(self, df):
+    def iter_row_batches(self, data):
         """
-        Prepare documents to be indexed in Elasticsearch.
-        :param df: DataFrame to be indexed
+        Yield consecutive slices of rows_per_batch rows.
+        :param data: DataFrame, or iterable of DataFrames such as S3DataFetcher.iter_parquet_batches(as_pandas=True)
+        """
+        for df in [data] if isinstance(data, pd.DataFrame) else data:
+            for start in range(0, len(df), self.rows_per_batch):
+                batch = df.iloc[start:start + self.rows_per_batch]
+                # Replace NaN values with 0 or another default value
+                yield batch.assign(num_reviews=batch['num_reviews'].fillna(0)) #ES cannot parse Nan
+
+    @staticmethod
+    def head_rows(data, max_rows):
+        """First max_rows rows of a DataFrame, or lazily of an iterable of DataFrames."""
+        if isinstance(data, pd.DataFrame):
+            return data.head(max_rows)
+
+        def frames():
+            remaining = max_rows
+            for df in data:
+                if remaining <= 0:
+                    return
+                df = df.head(remaining)
+                remaining -= len(df)
+                yield df
+        return frames()
+
+    @staticmethod
+    def total_rows(data):
+        """Row count for progress and checkpoints; None for a stream of frames."""
+        return len(data) if isinstance(data, pd.DataFrame) else None
+
+    def split_batch(self, batch):
+        """
+        Split every summary in a row batch into chunks.
+        :return: (rows, chunks) with one row entry per chunk
+        """
+        # Check for missing values in 'summary'
+        summaries = batch['summary'] if 'summary' in batch else [""] * len(batch)
+        summaries = [s if isinstance(s, str) and s else "No summary available" for s in summaries]
+
+        # Split long summaries into chunks, the whole column at once
+        positions, chunks = flatten_chunks(self.preprocessor.split_series_into_chunks(summaries))
+        batch_rows = [row for _, row in batch.iterrows()]
+        return [batch_rows[position] for position in positions], chunks
+
+    def build_action(self, row, chunk_idx, chunk, embedding):
+        """Bulk action for one summary chunk."""
+        if self.layout == "compact":
+            source = {field: row[field] for field in CHUNK_FILTER_FIELDS}
+            source.update({"book_id": str(row['id']), "summary_chunk": chunk, "embedding": embedding.tolist()})
+            return {
+                "_op_type": "index",
+                "_index": self.index_name,
+                "_id": f"{row['id']}_{chunk_idx}",  # Unique ID for each chunk
+                "_source": source,
+            }
+        return {
+            "_op_type": "index",
+            "_index": self.index_name,
+            "_id": f"{row['id']}_{chunk_idx}",  # Unique ID for each chunk
+            "_source": {
+                "url": row['url'],
+                "name": row['name'],
+                "author": row['author'],
+                "star_rating": row['star_rating'],
+                "num_ratings": row['num_ratings'],
+                "num_reviews": row['num_reviews'],
+                "summary_chunk": chunk,
+                "genres": row['genres'],
+                "first_published": row['first_published'],
+                "about_author": row['about_author'],
+                "community_reviews": row['community_reviews'],
+                "kindle_price": row['kindle_price'],
+                "embedding": embedding.tolist()
+            }
+        }
+
+    def build_book_action(self, row):
+        """Bulk action for the book metadata document of the compact layout."""
+        return {
+            "_op_type": "index",
+            "_index": self.books_index,
+            "_id": str(row['id']),
+            "_source": {field: row[field] for field in BOOK_FIELDS},
+        }
+
+    def embed_batch(self, batch):
+        """
+        Preprocess and embed one row batch.
+        :return: (kept, embeddings) with (row, chunk_idx, chunk) for every chunk whose
+                 embedding is non-zero, and those embeddings as an (n, 384) tensor
+        """
+        rows, chunks = self.split_batch(batch)
+
+        # Embed all chunks of the batch with batched forward passes
+        embeddings = self.embeddings_obj.get_embeddings(chunks, batch_size=self.embedding_batch_size,
+                                                        cache=self.embedding_cache)
+        norms = embeddings.norm(dim=1)
+
+        kept = []
+        next_chunk_idx = {}
+        for chunk, row, norm in zip(chunks, rows, norms):
+            #Check if embedding has zero magnitude (all zeros)
+            if norm == 0:
+                logging.warning(f"Empty embedding generated for text: {chunk}")
+                continue  # Skip this chunk if embedding is invalid
+            book_id = str(row['id'])
+            chunk_idx = next_chunk_idx.get(book_id, 0)
+            next_chunk_idx[book_id] = chunk_idx + 1
+            kept.append((row, chunk_idx, chunk))
+        return kept, embeddings[norms != 0]
+
+    def prepare_batch(self, batch, content_hashes=None):
+        """
+        Preprocess, embed and build the bulk actions for one row batch.
+        :param content_hashes: book id -> content hash; when given, each chunk also stores
+                               its book's hash and chunk count for later change detection
         """
-        documents = []  # List to store all the documents to be indexed
+        kept, embeddings = self.embed_batch(batch)
+        if self.vector_storage == "byte":
+            embeddings = quantize_int8(embeddings)  # Small ints instead of long floats in the bulk JSON
+
+        chunk_counts = Counter(str(row['id']) for row, _, _ in kept)
+        actions = []
+        for (row, chunk_idx, chunk), embedding in zip(kept, embeddings):
+            book_id = str(row['id'])
+            action = self.build_action(row, chunk_idx, chunk, embedding)
+            if content_hashes is not None:
+                action["_source"]["content_hash"] = content_hashes[book_id]
+                action["_source"]["chunk_count"] = chunk_counts[book_id]
+            actions.append(action)
+            if self.layout == "compact" and chunk_idx == 0:
+                actions.append(self.build_book_action(row))
+        return actions
+
+    def build_local_store(self, df, path, dtype="float16", ann="ivf", max_rows=None) -> LocalVectorStore:
+        """
+        Embed df, a DataFrame or an iterable of DataFrames, into a LocalVectorStore at path
+        instead of Elasticsearch.
+        The store is built next to path and swapped in when complete, so a
+        LocalVectorRetriever reading path keeps the previous version until then.
+        :param dtype: "float16" or "int8" vector storage
+        :param ann: "ivf", "hnsw" or "exact", see LocalVectorStoreWriter.finish
+        """
+        if max_rows is not None:
+            df = self.head_rows(df, max_rows)
+        writer = LocalVectorStoreWriter(path, dtype=dtype, model_name=self.embeddings_obj.model_name)
+        with tqdm(total=self.total_rows(df), desc="Building local store", unit="rows") as progress:
+            for batch in self.iter_row_batches(df):
+                kept, embeddings = self.embed_batch(batch)
+                records = [{field: row[field] for field in BOOK_FIELDS} |
+                           {"id": f"{row['id']}_{chunk_idx}", "book_id": str(row['id']), "summary_chunk": chunk}
+                           for row, chunk_idx, chunk in kept]
+                writer.add(embeddings, records)
+                progress.update(len(batch))
+        return writer.finish(ann=ann)
+
+    def content_hash(self, row) -> str:
+        """
+        Stable hash of a row's summary and metadata, and of the chunking and embedding settings,
+        so switching model, backend or vector storage re-indexes every book.
+        """
+        values = {"chunking": self.preprocessor.get_config(), "layout": self.layout,
+                  "embedding": {"model_name": self.embeddings_obj.model_name,
+                                "backend": self.embeddings_obj.backend,
+                                "vector_storage": self.vector_storage}}
+        for field in HASHED_FIELDS:
+            value = row.get(field)
+            values[field] = value.tolist() if hasattr(value, "tolist") else value  # numpy arrays/scalars
+        return hashlib.sha1(json.dumps(values, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def indexed_hashes(self, book_ids) -> dict:
+        """Hash and chunk count stored on each book's first chunk in the index."""
+        if not book_ids:
+            return {}
         try:
+            response = self.es_client.mget(index=self.index_name, ids=[f"{book_id}_0" for book_id in book_ids],
+                                           source_includes=["content_hash", "chunk_count"])
+        except NotFoundError:
+            return {}  # Index does not exist yet
+        found = {}
+        for doc in response["docs"]:
+            source = doc.get("_source", {})
+            if doc.get("found") and "content_hash" in source:
+                found[doc["_id"].rsplit("_", 1)[0]] = {"hash": source["content_hash"],
+                                                       "chunks": source.get("chunk_count", 1)}
+        return found
 
-            df = df.head(1000)  # Limit to first 1k/100k rows for testing
-            # Replace NaN values with 0 or another default value
-            df['num_reviews'].fillna(0, inplace=True) #ES cannot parse Nan
-            
-            for _, row in tqdm(df.iterrows(), total=len(df), desc="Processing Documents"):
-
-                # Check for missing values in 'summary'
-                summary = row.get('summary', '')  # Safer way to get column
-                if not summary:
-                    summary = "No summary available"
-
-                # Split long summaries into chunks
-                summary_chunks = self.preprocessor.split_text_into_chunks(
-                    self.preprocessor.preprocess_text(summary)
-                )
-
-
-                # Generate embeddings for each chunk
-                chunk_embeddings = []
-                for chunk in summary_chunks:
-                    if chunk:
-                        embedding = self.embeddings_obj.get_embedding(chunk)
-
-                        #Check if embedding has zero magnitude (all zeros)
-                        if embedding.shape[0] == 0 or embedding.norm() == 0:  # Check for zero embedding magnitude
-                            logging.warning(f"Empty embedding generated for text: {chunk}")
-                            continue  # Skip this chunk if embedding is invalid
-                        chunk_embeddings.append(embedding)
+    def prepare_incremental_batch(self, batch):
+        """
+        Incremental variant of prepare_batch.
+        Books whose hash matches the manifest (or, failing that, the index) are skipped
+        before embedding. Changed books are re-indexed and chunk ids left over from a
+        longer previous version are deleted.
+        :return: (actions, manifest updates for the batch)
+        """
+        hashes = {str(row['id']): self.content_hash(row) for _, row in batch.iterrows()}
+        previous = self.manifest.lookup(hashes)
+        previous.update(self.indexed_hashes([book_id for book_id in hashes if book_id not in previous]))
+
+        changed = [book_id for book_id, h in hashes.items() if previous.get(book_id, {}).get("hash") != h]
+        # Unchanged books found only in the index are recorded too, so the next run skips the lookup
+        updates = {book_id: previous[book_id] for book_id in hashes
+                   if book_id not in changed and book_id not in self.manifest.books}
+        if not changed:
+            return [], updates
+
+        changed_batch = batch[batch['id'].astype(str).isin(changed)]
+        actions = self.prepare_batch(changed_batch, content_hashes=hashes)
+        new_counts = Counter(action["_id"].rsplit("_", 1)[0] for action in actions
+                             if action["_index"] == self.index_name)
+
+        for book_id in changed:
+            # Delete stale chunks when a summary got shorter
+            for chunk_idx in range(new_counts[book_id], previous.get(book_id, {}).get("chunks", 0)):
+                actions.append({"_op_type": "delete", "_index": self.index_name, "_id": f"{book_id}_{chunk_idx}"})
+            # A book without indexed chunks (all embeddings failed) gets no hash, so the next run retries it
+            updates[book_id] = {"hash": hashes[book_id] if new_counts[book_id] else None,
+                                "chunks": new_counts[book_id]}
+        return actions, updates
+
+    def generate_documents(self, df, on_batch=None):
+        """
+        Lazily yield bulk actions for df, a DataFrame or an iterable of DataFrames.
+        Embedding runs in a background thread and hands finished row batches over a
+        bounded queue, so bulk requests overlap with embedding while at most
+        queue_size batches are held in memory.
+        :param on_batch: called with (num_rows, num_actions, manifest_updates) before a
+                         batch's actions are yielded; used for incremental checkpoints
+        """
+        batches = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+
+        def put(item):
+            # Give up if the consumer went away, instead of blocking on a full queue forever
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for batch in self.iter_row_batches(df):
+                    if self.manifest is not None:
+                        actions, updates = self.prepare_incremental_batch(batch)
                     else:
-                        continue  # Skip empty chunks
-
-
-                # Prepare documents for each chunk
-                for chunk_idx, (chunk, embedding) in tqdm(enumerate(zip(summary_chunks, chunk_embeddings)), \
-                                                          total=len(summary_chunks), leave=False):
-                    document = {
-                        "_op_type": "index",
-                        "_index": self.index_name,
-                        "_id": f"{row['id']}_{chunk_idx}",  # Unique ID for each chunk
-                        "_source": {
-                            "url": row['url'],
-                            "name": row['name'],
-                            "author": row['author'],
-                            "star_rating": row['star_rating'],
-                            "num_ratings": row['num_ratings'],
-                            "num_reviews": row['num_reviews'],
-                            "summary_chunk": chunk,
-                            "genres": row['genres'],
-                            "first_published": row['first_published'],
-                            "about_author": row['about_author'],
-                            "community_reviews": row['community_reviews'],
-                            "kindle_price": row['kindle_price'],
-                            "embedding": embedding.tolist() if not isinstance(embedding, list) else embedding 
-                        }
-                    }
-                    documents.append(document)
-
-            print(f"Finished processing all {len(df)} rows.")
-            return documents
+                        actions, updates = self.prepare_batch(batch), {}
+                    if not put((len(batch), actions, updates)):
+                        return
+            except Exception as e:
+                put(e)  # Re-raised in the consumer
+            finally:
+                put(_END_OF_BATCHES)
+
+        worker = threading.Thread(target=produce, name="embedding-producer", daemon=True)
+        worker.start()
+        try:
+            with tqdm(total=self.total_rows(df), desc="Processing Documents", unit="rows") as progress:
+                while True:
+                    item = batches.get()
+                    if item is _END_OF_BATCHES:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    num_rows, actions, updates = item
+                    if on_batch is not None:
+                        on_batch(num_rows, len(actions), updates)
+                    yield from actions
+                    progress.update(num_rows)
+        finally:
+            stop.set()
+            worker.join(timeout=1)
+
+    def prepare_documents(self, df):
+        """
+        Prepare documents to be indexed in Elasticsearch.
+        Materializes every action; use generate_documents for large frames.
+        :param df: DataFrame, or iterable of DataFrames, to be indexed
+        """
+        rows = 0
 
+        def count_rows(num_rows, num_actions, manifest_updates):
+            nonlocal rows
+            rows += num_rows
+
+        try:
+            documents = list(self.generate_documents(df, on_batch=count_rows))
+            print(f"Finished processing all {rows} rows.")
+            return documents
         except Exception as e:
             print("Error in prepare_documents():", traceback.format_exc())
             return []
 
+    def bulk_results(self, actions):
+        """Stream actions to ES, yielding (ok, item) per action."""
+        if self.bulk_threads > 1:
+            return parallel_bulk(self.es_client, actions, thread_count=self.bulk_threads,
+                                 chunk_size=self.bulk_chunk_size, queue_size=self.queue_size,
+                                 raise_on_error=False)
+        return streaming_bulk(self.es_client, actions, chunk_size=self.bulk_chunk_size,
+                              raise_on_error=False)
+
+    def resume_row(self, df) -> int:
+        """Row offset to resume from, if the manifest holds a checkpoint for this index and frame."""
+        checkpoint = self.manifest.checkpoint if self.manifest is not None else None
+        if not checkpoint:
+            return 0
+        if checkpoint.get("index") != self.index_name or checkpoint.get("total_rows") != len(df):
+            print("Checkpoint does not match this run, starting from the first row.")
+            return 0
+        print(f"Resuming from row {checkpoint['next_row']} of {len(df)}.")
+        return checkpoint["next_row"]
 
-    def index_data(self, df):
+    def index_data(self, df, max_rows=None):
         """
-        Index the DataFrame data into Elasticsearch using the bulk helper.
-        :param df: DataFrame to be indexed
+        Index the DataFrame data into Elasticsearch with streaming bulk requests.
+        Memory stays bounded by the queue, not by the size of df.
+        In incremental mode a batch is committed to the manifest once all of its
+        actions are acknowledged, and an interrupted run resumes after the last
+        committed batch.
+        :param df: DataFrame to be indexed; outside incremental mode also an iterable of
+                   DataFrames, e.g. row groups streamed from S3, so indexing starts with the first one
+        :param max_rows: optionally index only the first max_rows rows
+        :return: (indexed, failed) action counts, None if indexing stopped on an error
         """
+        if self.manifest is not None and df is not None and not isinstance(df, pd.DataFrame):
+            raise ValueError("Incremental indexing checkpoints row offsets and needs a DataFrame")
         try:
-            # Prepare the documents for indexing
-            print("Preparing documents for indexing...")
-            documents = self.prepare_documents(df)
-            print(f"Prepared {len(documents)} documents.")
-
-            if not documents:
+            if df is None or (isinstance(df, pd.DataFrame) and df.empty):
                 print("No documents to index.")
                 return
+            if max_rows is not None:
+                df = self.head_rows(df, max_rows)
+
+            start_row = self.resume_row(df) if self.manifest is not None else 0
+            pending = deque()  # Batches whose actions are not all acknowledged yet, in order
+            next_row = start_row
+
+            def register_batch(num_rows, num_actions, updates):
+                nonlocal next_row
+                next_row += num_rows
+                pending.append({"remaining": num_actions, "next_row": next_row,
+                                "updates": updates, "failed": set()})
+
+            def commit_finished():
+                # Bulk results arrive in action order, so batches finish front to back
+                while pending and pending[0]["remaining"] == 0:
+                    batch = pending.popleft()
+                    if self.manifest is not None:
+                        updates = {book_id: entry for book_id, entry in batch["updates"].items()
+                                   if book_id not in batch["failed"]}  # Failed books are retried next run
+                        self.manifest.commit(updates, checkpoint={"index": self.index_name,
+                                                                  "total_rows": len(df),
+                                                                  "next_row": batch["next_row"]})
+
+            total_rows = self.total_rows(df)
+            print(f"Streaming {'all' if total_rows is None else total_rows - start_row} rows into '{self.index_name}'...")
+            success, failed, skipped_deletes = 0, 0, 0
+            source = df.iloc[start_row:] if start_row else df
+            for ok, item in self.bulk_results(self.generate_documents(source, on_batch=register_batch)):
+                op_type, result = next(iter(item.items()))
+                if not ok and op_type == "delete" and result.get("status") == 404:
+                    ok = True  # Stale chunk was already gone
+                    skipped_deletes += 1
+                if ok:
+                    success += 1
+                else:
+                    failed += 1
+                    print(f"Failed document: {item}")  # Logs each failed document's error message
+
+                commit_finished()
+                pending[0]["remaining"] -= 1
+                if not ok:
+                    # Chunk ids are {book}_{idx}, book documents are just {book}; marking both is safe
+                    doc_id = result.get("_id", "")
+                    pending[0]["failed"].update({doc_id, doc_id.rsplit("_", 1)[0]})
+                commit_finished()
+            commit_finished()
 
-            # Using bulk to send the documents to Elasticsearch
-            success, failed = bulk(self.es_client, documents, raise_on_error=False)  #AI COMMENT: Added raise_on_error=False to prevent exception and log failed docs
             print(f"Successfully indexed {success} documents.")
+            if self.embedding_cache is not None:
+                print(f"Embedding cache: {self.embedding_cache.stats()}")
+            if isinstance(self.embeddings_obj, EmbeddingWorkerPool):
+                for pid, stats in self.embeddings_obj.stats().items():
+                    print(f"Embedding worker {pid}: {stats['rows']} rows, {stats['rows_per_sec']:.1f} rows/sec")
+            if skipped_deletes:
+                print(f"{skipped_deletes} stale chunks were already deleted.")
             if failed:
-                print(f"Failed to index {len(failed)} documents.")  #AI COMMENT: Added logging for failed documents
-                # Log the details of the failed documents
-                for error in failed:
-                    print(f"Failed document: {error}")  #AI COMMENT: Logs each failed document's error message
+                print(f"Failed to index {failed} documents.")
+            if self.manifest is not None:
+                self.manifest.compact()  # Run finished, drop the checkpoint
+            return success, failed
 
         except RequestError as e:
             print(f"Elasticsearch request error: {str(e)}")
         except ConnectionError as e:
             print(f"Elasticsearch connection error: {str(e)}")
-        except BulkIndexError as e:  #AI COMMENT: Caught BulkIndexError to handle the bulk-specific error
+        except BulkIndexError as e:
             print(f"Bulk index error: {str(e)}")
         except Exception as e:
             print("Unexpected error:", traceback.format_exc())  # Logs full traceback
-        
+
+
+def rebuild_index(es_client, alias, df, replicas=1, delete_old=False, vector_storage="float", layout="full",
+                  **indexer_kwargs):
+    """
+    Full rebuild into a fresh versioned index, loaded with refreshes and replicas off,
+    then force-merged and swapped in behind alias. Queries on the alias keep hitting
+    the previous index until the swap. df may be an iterable of DataFrames.
+    The alias only moves when documents were indexed and none failed; otherwise the
+    new index is deleted.
+    :return: the indexer, so callers can close its worker pools
+    """
+    store = ElasticsearchVectorStore(None, alias, es_client=es_client, create=False, layout=layout)
+    versioned_index = store.begin_bulk_load(vector_storage=vector_storage)
+    try:
+        indexer = GoodreadsIndexer(es_client=es_client, index_name=versioned_index, vector_storage=vector_storage,
+                                   layout=layout, **indexer_kwargs)
+        result = indexer.index_data(df)
+    except BaseException:
+        store.abort_bulk_load(versioned_index)
+        raise
+    if result is None or result[0] == 0 or result[1]:
+        print(f"Bulk load into '{versioned_index}' did not complete cleanly ({result}), alias '{alias}' left unchanged.")
+        store.abort_bulk_load(versioned_index)
+        return indexer
+    store.finish_bulk_load(versioned_index, replicas=replicas, delete_old=delete_old)
+    return indexer
+
 
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description="Index Goodreads summaries into Elasticsearch.")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="load a new versioned index and swap the alias, instead of updating in place")
+    parser.add_argument("--vector-storage", choices=["float", "int8_hnsw", "byte"], default="float",
+                        help="vector element type of a rebuilt index")
+    parser.add_argument("--layout", choices=["full", "compact"], default="full",
+                        help="compact stores book metadata once in '<index>_books' instead of in every chunk")
+    parser.add_argument("--local-store", metavar="DIR",
+                        help="build a local memory-mapped vector store in DIR/<index> instead of using Elasticsearch")
+    parser.add_argument("--local-dtype", choices=["float16", "int8"], default="float16")
+    parser.add_argument("--local-ann", choices=["ivf", "hnsw", "exact"], default="ivf")
+    args = parser.parse_args()
+
     # Get ES Client
     es_host = "http://localhost:9200"
     index_name = "goodreads"
     es_client = Elasticsearch(es_host, verify_certs=False)
 
-    # Index the data
-    indexer = GoodreadsIndexer(es_client=es_client, index_name=index_name)
+    indexer_kwargs = dict(
+        embedding_workers=max(1, (os.cpu_count() or 1) // 4),
+        chunk_tokens=254,  # MiniLM's 256 token window minus [CLS]/[SEP]
+        embedding_cache_dir="./.embedding_cache",
+    )
 
-    # Load processed data
+    # Load processed data, only the columns that get indexed
     s3_data_fetch = S3DataFetcher(env_path="../ingestion/.env")
-    processed_data = s3_data_fetch.fetch_parquet_from_s3()
+    columns = ["id", "summary", *BOOK_FIELDS]
+    if args.local_store or args.rebuild:
+        # Row groups are indexed as they arrive, holding about one at a time
+        processed_data = s3_data_fetch.iter_parquet_batches(columns=columns, as_pandas=True)
+    else:
+        # Incremental checkpoints are row offsets into one frame
+        processed_data = s3_data_fetch.fetch_parquet_from_s3(columns=columns)
 
-    # Index the data into ES
-    indexer.index_data(df=processed_data)
+    # Index the data into ES, or into a local store
+    if args.local_store:
+        indexer = GoodreadsIndexer(es_client=None, index_name=index_name, **indexer_kwargs)
+        indexer.build_local_store(processed_data, os.path.join(args.local_store, index_name),
+                                  dtype=args.local_dtype, ann=args.local_ann)
+    elif args.rebuild:
+        indexer = rebuild_index(es_client, index_name, processed_data, vector_storage=args.vector_storage,
+                                layout=args.layout, **indexer_kwargs)
+    else:
+        # Update in place, skipping books that did not change since the last run
+        ElasticsearchVectorStore(None, index_name, es_client=es_client, layout=args.layout)  # Creates missing indices
+        indexer = GoodreadsIndexer(es_client=es_client, index_name=index_name, layout=args.layout,
+                                   manifest_path=f"./{index_name}_manifest.jsonl", **indexer_kwargs)
+        indexer.index_data(df=processed_data)
+    indexer.preprocessor.close()
+    if isinstance(indexer.embeddings_obj, EmbeddingWorkerPool):
+        indexer.embeddings_obj.close()
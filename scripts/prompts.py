@@ -1,45 +1,375 @@
-from transformers import LlamaTokenizer, LlamaForCausalLM
+from transformers import AutoTokenizer
 import sys
 import os
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from indexing.search import ElasticsearchRetriever
+from indexing.model_registry import registry, get_embedding_model
+from indexing.answer_cache import AnswerCache, document_ids
 import ollama
 
+# Tokenizer of the Ollama model; an ungated copy of the Llama 3.2 tokenizer, so no HF token is needed
+GENERATOR_TOKENIZER = os.getenv("GENERATOR_TOKENIZER", "unsloth/Llama-3.2-3B-Instruct")
+CHARS_PER_TOKEN = 4  # Estimate used when the tokenizer cannot be loaded
+MIN_OVERLAP_CHARS = 16  # Shortest suffix/prefix match treated as chunk overlap
+PROMPT_TEMPLATE_VERSION = "2"  # Bump when the prompt wording changes, so cached answers are not reused
+
+
 class PromptGenerator:
-    def __init__(self):
-        pass
+    """
+    Builds the answer prompt from retrieved chunks within a token budget.
+    Chunks of the same book are deduplicated and merged into one document, books are
+    ordered by their best score and added until the budget is spent; the last book
+    that does not fit whole is truncated if enough budget is left for it.
+    """
+
+    def __init__(self, token_budget=1536, tokenizer_name=GENERATOR_TOKENIZER, min_document_tokens=32):
+        """
+        :param token_budget: tokens the whole prompt may use; keep it below the model's num_ctx
+                             minus the expected answer length
+        :param tokenizer_name: Hugging Face tokenizer matching the generator model
+        :param min_document_tokens: a truncated document shorter than this is dropped instead
+        """
+        self.token_budget = token_budget
+        self.min_document_tokens = min_document_tokens
+        try:
+            self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+        except Exception as e:
+            logging.warning(f"Could not load tokenizer {tokenizer_name}: {e}. The token budget is only estimated "
+                            f"at {CHARS_PER_TOKEN} chars per token and may be exceeded; set GENERATOR_TOKENIZER "
+                            f"to a tokenizer matching the generator model.")
+            self.tokenizer = None
+        # Everything besides the chunks that changes the prompt text, part of the answer cache key
+        self.template_version = (f"{PROMPT_TEMPLATE_VERSION}/budget={token_budget}/min={min_document_tokens}"
+                                 f"/tokens={tokenizer_name if self.tokenizer is not None else 'estimated'}")
+
+    def count_tokens(self, texts: list) -> list:
+        if self.tokenizer is None:
+            return [-(-len(text) // CHARS_PER_TOKEN) for text in texts]
+        return [len(ids) for ids in self.tokenizer(texts, add_special_tokens=False)["input_ids"]]
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if self.tokenizer is None:
+            return text[:max_tokens * CHARS_PER_TOKEN]
+        ids = self.tokenizer(text, add_special_tokens=False)["input_ids"][:max_tokens]
+        return self.tokenizer.decode(ids)
+
+    @staticmethod
+    def merge_chunks(chunks: list) -> str:
+        """Join a book's chunks in order, dropping repeated chunks and the overlap between neighbours."""
+        merged = []
+        seen = set()
+        for chunk in chunks:
+            chunk = chunk.strip()
+            if not chunk or chunk in seen:
+                continue
+            seen.add(chunk)
+            if merged:
+                previous = merged[-1]
+                overlap = next((size for size in range(min(len(previous), len(chunk)), MIN_OVERLAP_CHARS - 1, -1)
+                                if previous.endswith(chunk[:size])), 0)
+                chunk = chunk[overlap:].lstrip()
+                if not chunk:
+                    continue
+            merged.append(chunk)
+        return " ".join(merged)
+
+    @staticmethod
+    def group_by_book(documents: list) -> list:
+        """
+        Group retrieved chunks per book, best scoring book first.
+        :param documents: search hits (with _id, _score and _source) or plain documents in rank order
+        :return: list of (book document, [chunk texts in chunk order], chunks received)
+        """
+        books = {}
+        for rank, doc in enumerate(documents):
+            source = doc.get("_source", doc)
+            doc_id = doc.get("_id", "")
+            book_key = source.get("book_id") or doc_id.rsplit("_", 1)[0] or source.get("url") or source.get("name")
+            chunk_idx = doc_id.rsplit("_", 1)[-1]
+            position = int(chunk_idx) if chunk_idx.isdigit() else rank
+            score = doc.get("_score")
+            sort_key = -score if score is not None else rank  # Plain documents arrive already ranked
+
+            book = books.setdefault(book_key, {"source": source, "best": sort_key, "chunks": []})
+            book["best"] = min(book["best"], sort_key)
+            book["chunks"].append((position, source.get("summary_chunk", "")))
+
+        ordered = sorted(books.values(), key=lambda book: book["best"])
+        return [(book["source"], [text for _, text in sorted(book["chunks"], key=lambda chunk: chunk[0])],
+                 len(book["chunks"])) for book in ordered]
+
+    def pack_context(self, documents: list, query: str):
+        """
+        :return: (prompt, report) where report counts packed and dropped tokens, books and chunks
+        """
+        header = "Based on the following documents, answer the question:\n\n"
+        footer = f"Answer the question: {query}"
+        books = self.group_by_book(documents)
+        blocks = [f"Document: {source.get('name')}\nSummary: {self.merge_chunks(chunks)}\n\n"
+                  for source, chunks, _ in books]
+        header_tokens, footer_tokens, *block_tokens = self.count_tokens([header, footer] + blocks)
+
+        remaining = max(0, self.token_budget - header_tokens - footer_tokens)
+        packed = []
+        packed_tokens = dropped_tokens = books_truncated = 0
+        for block, tokens in zip(blocks, block_tokens):
+            if tokens <= remaining:
+                packed.append(block)
+                packed_tokens += tokens
+                remaining -= tokens
+                continue
+            if remaining >= self.min_document_tokens:
+                # The truncated tail is re-tokenized and can come out longer; shrink until it fits
+                target, kept = remaining - 2, remaining + 1
+                while target >= self.min_document_tokens:
+                    truncated = self.truncate(block, target).rstrip() + "\n\n"
+                    kept = self.count_tokens([truncated])[0]
+                    if kept <= remaining:
+                        break
+                    target -= kept - remaining
+                if kept <= remaining:
+                    packed.append(truncated)
+                    packed_tokens += kept
+                    dropped_tokens += tokens - kept
+                    books_truncated += 1
+                    remaining -= kept
+                    continue
+            dropped_tokens += tokens
+
+        report = {
+            "budget": self.token_budget,
+            "prompt_tokens": header_tokens + packed_tokens + footer_tokens,
+            "packed_tokens": packed_tokens,
+            "dropped_tokens": dropped_tokens,
+            "books_packed": len(packed),
+            "books_truncated": books_truncated,
+            "books_dropped": len(blocks) - len(packed),
+            "chunks_merged": sum(count for _, _, count in books) - len(books),
+        }
+        return "".join([header, *packed, footer]), report
 
-    def create_prompt(self, documents, query: str):
+    def create_prompt(self, documents, query: str, report=None):
         """Creates the prompt the documets retrived from elastic search as 
         context amd uses the same search query used for getting docs from ES
+        :param report: optional dict, filled with the packing report of pack_context
         """
-        prompt = "Based on the following documents, answer the question:\n\n"
-        for doc in documents:
-            prompt += f"Document: {doc['name']}\nSummary: {doc['summary_chunk']}\n\n"
-        prompt += f"Answer the question: {query}"
+        prompt, packing = self.pack_context(documents, query)
+        if report is not None:
+            report.update(packing)
         return prompt
     
 class AnswerGenerator:
-    def __init__(self, model_name="llama3.2:3b"):
+    """
+    Generates answers with an Ollama chat model, streaming tokens as they arrive.
+    At most max_concurrency generations run at once, sync and async counted separately;
+    further requests wait for a slot. Each finished generation records its time to
+    first token and decode speed, see metrics().
+    With an answer_cache, a request carrying a cache_key (see cache_key()) is answered
+    from the cache when possible and never reaches Ollama.
+    """
+
+    def __init__(self, model_name="llama3.2:3b", host=None, keep_alive="30m", max_concurrency=4,
+                 answer_cache=None):
+        """
+        :param host: Ollama server, e.g. http://localhost:11434; None uses OLLAMA_HOST or the default.
+                     Point it at scripts/stub_ollama.py to run without a real model
+        :param keep_alive: how long Ollama keeps the model loaded after a request, so
+                           back-to-back questions skip the model load
+        :param max_concurrency: generation requests in flight at once
+        :param answer_cache: AnswerCache holding earlier answers
+        """
         self.model_name = model_name
+        self.host = host
+        self.keep_alive = keep_alive
+        self.max_concurrency = max_concurrency
+        self.answer_cache = answer_cache
+        self.client = ollama.Client(host=host)
+        self._async_client = None  # Created inside the running event loop
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._async_slots = asyncio.Semaphore(max_concurrency)
+
+        self._metrics_lock = threading.Lock()
+        self._generations = 0
+        self._tokens = 0
+        self._ttft_seconds = 0.0
+        self._decode_seconds = 0.0
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            self._async_client = ollama.AsyncClient(host=self.host)
+        return self._async_client
+
+    def messages(self, prompt: str) -> list:
+        return [{"role": "user", "content": prompt}]
+
+    def warm_up(self):
+        """Load the model into Ollama ahead of the first question; a chat without messages only loads it."""
+        self.client.chat(model=self.model_name, messages=[], keep_alive=self.keep_alive)
+
+    def cache_key(self, query: str, documents: list, prompt_generator) -> str:
+        """Answer cache key of a question answered from these retrieved documents."""
+        return AnswerCache.key(self.model_name, prompt_generator.template_version, query, document_ids(documents))
+
+    def cached_answer(self, cache_key, stats=None):
+        if self.answer_cache is None or cache_key is None:
+            return None
+        answer = self.answer_cache.get(cache_key)
+        if answer is not None and stats is not None:
+            stats.update({"cached": True, "ttft_ms": 0.0, "total_ms": 0.0, "tokens": 0, "tokens_per_sec": 0.0})
+        return answer
+
+    def store_answer(self, cache_key, pieces: list):
+        if self.answer_cache is not None and cache_key is not None:
+            self.answer_cache.put(cache_key, "".join(pieces), {"model": self.model_name})
+
+    def generate_answer(self, prompt: str, stats=None, cache_key=None) -> str:
+        """Generate the whole answer and return it."""
+        return "".join(self.stream_answer(prompt, stats, cache_key))
+
+    def stream_answer(self, prompt: str, stats=None, cache_key=None):
+        """
+        Yield the answer token by token; a cached answer is yielded in one piece.
+        :param stats: optional dict, filled with ttft_ms, total_ms, tokens and tokens_per_sec once the answer ends
+        :param cache_key: look the answer up in, and store it to, the answer cache under this key
+        """
+        answer = self.cached_answer(cache_key, stats)
+        if answer is not None:
+            yield answer
+            return
+        pieces = []
+        for token in self._stream_from_model(prompt, stats):
+            pieces.append(token)
+            yield token
+        self.store_answer(cache_key, pieces)  # Only reached when the whole answer was generated
+
+    def _stream_from_model(self, prompt: str, stats=None):
+        with self._slots:
+            started = time.perf_counter()
+            first_token_at = None
+            pieces = 0
+            final = None
+            for chunk in self.client.chat(model=self.model_name, messages=self.messages(prompt), stream=True,
+                                          keep_alive=self.keep_alive):
+                content = chunk["message"]["content"]
+                if content:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    pieces += 1
+                    yield content
+                if chunk.get("done"):
+                    final = chunk
+            self._record(stats, started, first_token_at, pieces, final)
+
+    async def astream_answer(self, prompt: str, stats=None, cache_key=None):
+        """Async version of stream_answer; answer cache reads and writes run in a thread, off the event loop."""
+        use_cache = self.answer_cache is not None and cache_key is not None
+        answer = await asyncio.to_thread(self.cached_answer, cache_key, stats) if use_cache else None
+        if answer is not None:
+            yield answer
+            return
+        pieces = []
+        async for token in self._astream_from_model(prompt, stats):
+            pieces.append(token)
+            yield token
+        if use_cache:
+            await asyncio.to_thread(self.store_answer, cache_key, pieces)
+
+    async def _astream_from_model(self, prompt: str, stats=None):
+        async with self._async_slots:
+            started = time.perf_counter()
+            first_token_at = None
+            pieces = 0
+            final = None
+            async for chunk in await self.async_client.chat(model=self.model_name, messages=self.messages(prompt),
+                                                            stream=True, keep_alive=self.keep_alive):
+                content = chunk["message"]["content"]
+                if content:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    pieces += 1
+                    yield content
+                if chunk.get("done"):
+                    final = chunk
+            self._record(stats, started, first_token_at, pieces, final)
 
-    def generate_answer(self, prompt: str):
-        response = ollama.chat(model=self.model_name, messages=[{"role": "user", "content": prompt}])
-        print(response['message']['content'])
+    async def agenerate_answer(self, prompt: str, stats=None, cache_key=None) -> str:
+        return "".join([token async for token in self.astream_answer(prompt, stats, cache_key)])
+
+    def generate_many(self, prompts: list) -> list:
+        """Answer several prompts, max_concurrency at a time; answers come back in prompt order."""
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="generation") as pool:
+            return list(pool.map(self.generate_answer, prompts))
+
+    async def agenerate_many(self, prompts: list) -> list:
+        return await asyncio.gather(*(self.agenerate_answer(prompt) for prompt in prompts))
+
+    def _record(self, stats, started, first_token_at, pieces, final):
+        finished = time.perf_counter()
+        first_token_at = first_token_at if first_token_at is not None else finished
+        # Ollama reports the exact decode token count and time on its last chunk; streamed pieces are the fallback
+        tokens = final.get("eval_count") if final is not None else None
+        eval_ns = final.get("eval_duration") if final is not None else None
+        if tokens and eval_ns:
+            decode_seconds = eval_ns / 1e9
+        else:
+            tokens = pieces
+            decode_seconds = finished - first_token_at
+        result = {
+            "ttft_ms": 1000 * (first_token_at - started),
+            "total_ms": 1000 * (finished - started),
+            "tokens": tokens,
+            "tokens_per_sec": tokens / decode_seconds if decode_seconds > 0 else 0.0,
+        }
+        if stats is not None:
+            stats.update(result, cached=False)
+        with self._metrics_lock:
+            self._generations += 1
+            self._tokens += tokens
+            self._ttft_seconds += first_token_at - started
+            self._decode_seconds += decode_seconds
+
+    def metrics(self) -> dict:
+        """Mean time to first token and overall decode speed across finished generations."""
+        with self._metrics_lock:
+            return {
+                "generations": self._generations,
+                "tokens": self._tokens,
+                "mean_ttft_ms": 1000 * self._ttft_seconds / self._generations if self._generations else 0.0,
+                "tokens_per_sec": self._tokens / self._decode_seconds if self._decode_seconds else 0.0,
+            }
     
 
 if __name__ == "__main__":
 
+    #0. Load and warm the embedding model once, before the first query
+    get_embedding_model()
+    print(f"Embedding model stats: {registry.stats()}")
+
     #1. Get docs from elastic search
     search = ElasticsearchRetriever()
     query_text = "Find me books that have a summary like a murder mystery in a small town. The protagonist must be female."
-    retrived_docs = search.vector_search(query_text, 'goodreads', 10)
+    retrived_docs = search.search_hits(query_text, 'goodreads', top_k=10)
 
-    #2. Generate Prompt
+    #2. Generate Prompt, packed into the token budget
     p = PromptGenerator()
-    prompt = p.create_prompt(documents=retrived_docs, query=query_text)
+    packing = {}
+    prompt = p.create_prompt(documents=retrived_docs, query=query_text, report=packing)
+    print(f"Context packing: {packing}")
 
-    #3. Generate answer
-    a = AnswerGenerator()
-    a.generate_answer(prompt=prompt)
+    #3. Stream the answer as it is generated, or reuse the answer to the same question and documents
+    answer_cache = AnswerCache(os.getenv("ANSWER_CACHE_PATH", os.path.join(
+        os.path.expanduser("~"), ".cache", "document-llm", "answers.sqlite")))
+    a = AnswerGenerator(answer_cache=answer_cache)
+    stats = {}
+    cache_key = a.cache_key(query_text, retrived_docs, p)
+    for token in a.stream_answer(prompt=prompt, stats=stats, cache_key=cache_key):
+        print(token, end="", flush=True)
+    print(f"\n\nGeneration stats: {stats}")
+    print(f"Answer cache stats: {answer_cache.stats()}")
 
@@ -0,0 +1,256 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import sys
+import time
+
+from aiohttp import web
+from elasticsearch import BadRequestError
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from indexing.async_search import AsyncElasticsearchRetriever
+from indexing.micro_batcher import MicroBatchEmbedder
+from indexing.model_registry import registry, get_embedding_model
+from indexing.answer_cache import AnswerCache
+from scripts.prompts import PromptGenerator, AnswerGenerator
+
+
+class RAGService:
+    """
+    Long-running question answering service: retrieve, pack the prompt, generate.
+    The embedding model, ES client, prompt tokenizer and Ollama model are loaded and
+    warmed once at startup, so a request only pays for retrieval and generation.
+    At most max_concurrent_requests are answered at once and max_queued_requests wait
+    for a slot; beyond that requests are rejected with 503 so latency stays bounded.
+
+    Endpoints:
+        POST /query    {"query": ..., "top_k": 10, "filters": {...}, "stream": true}
+                       streams NDJSON lines: documents, then tokens, then done
+        GET  /health   the process is up
+        GET  /ready    startup finished and Elasticsearch answers
+        GET  /metrics  cache, batching and generation counters
+    """
+
+    def __init__(self, es_host='localhost', es_port=9200, es_scheme='http', index_name='goodreads',
+                 ollama_host=None, generator_model="llama3.2:3b", keep_alive="30m",
+                 max_concurrent_requests=4, max_queued_requests=16, top_k=10, token_budget=1536,
+                 answer_cache_path=None):
+        """
+        :param max_concurrent_requests: requests retrieving or generating at once; also the
+                                        number of concurrent Ollama generations
+        :param max_queued_requests: requests allowed to wait for a slot before new ones get 503
+        :param answer_cache_path: SQLite file of the answer cache, None disables it
+        """
+        self.es_host = es_host
+        self.es_port = es_port
+        self.es_scheme = es_scheme
+        self.index_name = index_name
+        self.ollama_host = ollama_host
+        self.generator_model = generator_model
+        self.keep_alive = keep_alive
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_queued_requests = max_queued_requests
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.answer_cache_path = answer_cache_path
+
+        self.retriever = None
+        self.query_batcher = None
+        self.prompt_generator = None
+        self.answer_generator = None
+        self.answer_cache = None
+        self.ready = False
+        self.startup_seconds = None
+        self._slots = asyncio.Semaphore(max_concurrent_requests)
+        self._admitted = 0  # Requests running or waiting for a slot
+        self._rejected = 0
+        self._served = 0  # Answers completed
+        self._failed = 0  # Invalid requests, failed searches and generations
+
+    async def startup(self, app):
+        """Load and warm every model and client before reporting ready."""
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        # Model loads block, keep them off the event loop so /health answers meanwhile
+        embedding_model = await loop.run_in_executor(None, get_embedding_model)
+        self.query_batcher = MicroBatchEmbedder(embedding_model)
+        # Same model and backend as the batcher, including an eager fallback
+        self.retriever = AsyncElasticsearchRetriever(self.es_host, self.es_port, self.es_scheme,
+                                                     model_name=embedding_model.model_name,
+                                                     embedding_backend=embedding_model.backend,
+                                                     query_batcher=self.query_batcher)
+        self.prompt_generator = await loop.run_in_executor(None, lambda: PromptGenerator(token_budget=self.token_budget))
+        if self.answer_cache_path:
+            self.answer_cache = AnswerCache(self.answer_cache_path)
+        self.answer_generator = AnswerGenerator(self.generator_model, host=self.ollama_host, keep_alive=self.keep_alive,
+                                                max_concurrency=self.max_concurrent_requests,
+                                                answer_cache=self.answer_cache)
+        try:
+            await loop.run_in_executor(None, self.answer_generator.warm_up)
+        except Exception as e:
+            logging.error(f"Could not warm up {self.generator_model}, first answer will pay the model load: {e}")
+
+        self.startup_seconds = time.perf_counter() - started
+        self.ready = True
+        print(f"RAG service ready in {self.startup_seconds:.2f}s, embedding model: {registry.stats()}")
+
+    async def shutdown(self, app):
+        self.ready = False
+        if self.retriever is not None:
+            await self.retriever.close()
+        if self.query_batcher is not None:
+            self.query_batcher.close()
+        if self.answer_cache is not None:
+            self.answer_cache.close()
+
+    async def health(self, request):
+        return web.json_response({"status": "ok"})
+
+    async def readiness(self, request):
+        if not self.ready:
+            return web.json_response({"status": "starting"}, status=503)
+        if not await self.retriever.es.ping():
+            return web.json_response({"status": "elasticsearch unavailable"}, status=503)
+        return web.json_response({"status": "ready", "startup_seconds": self.startup_seconds})
+
+    async def metrics(self, request):
+        return web.json_response({
+            "requests": {"in_flight": self._admitted, "served": self._served, "failed": self._failed,
+                         "rejected": self._rejected},
+            "embedding_batches": self.query_batcher.metrics() if self.query_batcher else {},
+            "generation": self.answer_generator.metrics() if self.answer_generator else {},
+            "answer_cache": self.answer_cache.stats() if self.answer_cache else {},
+        })
+
+    async def query(self, request):
+        if not self.ready:
+            return web.json_response({"error": "service is starting"}, status=503)
+        try:
+            body = await request.json()
+            query_text = body["query"]
+        except (ValueError, KeyError, TypeError):
+            query_text = None
+        if not isinstance(query_text, str) or not query_text.strip():
+            self._failed += 1
+            return web.json_response({"error": "expected a JSON body with a non-empty 'query' string"}, status=400)
+        if not isinstance(body.get("filters", {}), (dict, type(None))):
+            self._failed += 1
+            return web.json_response({"error": "filters must be an object"}, status=400)
+        if not isinstance(body.get("index", self.index_name), str):
+            self._failed += 1
+            return web.json_response({"error": "index must be a string"}, status=400)
+        top_k = body.get("top_k", self.top_k)
+        if not isinstance(top_k, int) or isinstance(top_k, bool) or not 1 <= top_k <= self.retriever.num_candidates:
+            self._failed += 1
+            return web.json_response({"error": f"top_k must be an integer from 1 to {self.retriever.num_candidates}"},
+                                     status=400)
+
+        if self._admitted >= self.max_concurrent_requests + self.max_queued_requests:
+            self._rejected += 1
+            return web.json_response({"error": "too many requests"}, status=503, headers={"Retry-After": "1"})
+        self._admitted += 1
+        try:
+            async with self._slots:
+                return await self.answer(request, query_text, body, top_k)
+        except (ConnectionResetError, asyncio.CancelledError):
+            raise  # Client went away
+        except Exception:
+            self._failed += 1
+            raise
+        finally:
+            self._admitted -= 1
+
+    async def answer(self, request, query_text: str, body: dict, top_k: int):
+        started = time.perf_counter()
+        try:
+            hits = await self.retriever.search_hits(query_text, body.get("index", self.index_name),
+                                                    top_k=top_k, filters=body.get("filters"))
+        except ValueError as e:
+            self._failed += 1
+            return web.json_response({"error": str(e)}, status=400)  # Unknown filter field
+        except BadRequestError as e:
+            self._failed += 1
+            return web.json_response({"error": f"invalid search: {e.message}"}, status=400)  # e.g. a malformed filter value
+        retrieval_ms = 1000 * (time.perf_counter() - started)
+
+        loop = asyncio.get_running_loop()
+        prompt, packing = await loop.run_in_executor(None, self.prompt_generator.pack_context, hits, query_text)
+        cache_key = self.answer_generator.cache_key(query_text, hits, self.prompt_generator)
+        documents = [{"id": hit["_id"], "score": hit.get("_score"), "name": hit["_source"].get("name"),
+                      "author": hit["_source"].get("author")} for hit in hits]
+        stats = {}
+        tokens = self.answer_generator.astream_answer(prompt, stats, cache_key)
+
+        if not body.get("stream", True):
+            try:
+                async with contextlib.aclosing(tokens):
+                    answer = "".join([token async for token in tokens])
+            except Exception as e:
+                logging.error(f"Generation failed for query '{query_text}': {e}")
+                self._failed += 1
+                return web.json_response({"error": "generation failed"}, status=502)
+            self._served += 1
+            return web.json_response({"answer": answer, "documents": documents, "packing": packing,
+                                      "retrieval_ms": retrieval_ms, "generation": stats})
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        await self.write_line(response, {"type": "documents", "documents": documents, "packing": packing,
+                                         "retrieval_ms": retrieval_ms})
+        # Closing the generator on a client disconnect releases its generation slot
+        try:
+            async with contextlib.aclosing(tokens):
+                async for token in tokens:
+                    await self.write_line(response, {"type": "token", "text": token})
+        except (ConnectionResetError, asyncio.CancelledError):
+            raise  # Client went away
+        except Exception as e:
+            logging.error(f"Generation failed for query '{query_text}': {e}")
+            self._failed += 1
+            await self.write_line(response, {"type": "error", "error": "generation failed"})
+            await response.write_eof()
+            return response
+        self._served += 1
+        await self.write_line(response, {"type": "done", "generation": stats,
+                                         "total_ms": 1000 * (time.perf_counter() - started)})
+        await response.write_eof()
+        return response
+
+    @staticmethod
+    async def write_line(response, payload: dict):
+        await response.write(json.dumps(payload).encode("utf-8") + b"\n")
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.on_startup.append(self.startup)
+        app.on_cleanup.append(self.shutdown)
+        app.router.add_post("/query", self.query)
+        app.router.add_get("/health", self.health)
+        app.router.add_get("/ready", self.readiness)
+        app.router.add_get("/metrics", self.metrics)
+        return app
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Goodreads RAG HTTP service")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--es-host", default=os.getenv("ES_HOST", "localhost"))
+    parser.add_argument("--es-port", type=int, default=int(os.getenv("ES_PORT", 9200)))
+    parser.add_argument("--index", default="goodreads")
+    parser.add_argument("--ollama-host", default=os.getenv("OLLAMA_HOST"))
+    parser.add_argument("--model", default="llama3.2:3b")
+    parser.add_argument("--max-concurrent", type=int, default=4)
+    parser.add_argument("--max-queued", type=int, default=16)
+    parser.add_argument("--token-budget", type=int, default=1536)
+    parser.add_argument("--answer-cache", default=os.getenv("ANSWER_CACHE_PATH"))
+    args = parser.parse_args()
+
+    service = RAGService(args.es_host, args.es_port, index_name=args.index, ollama_host=args.ollama_host,
+                         generator_model=args.model, max_concurrent_requests=args.max_concurrent,
+                         max_queued_requests=args.max_queued, token_budget=args.token_budget,
+                         answer_cache_path=args.answer_cache)
+    web.run_app(service.app(), port=args.port)
@@ -0,0 +1,93 @@
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_ANSWER = "Based on the documents, you might enjoy a small town murder mystery with a female detective."
+
+
+class StubChatHandler(BaseHTTPRequestHandler):
+    """
+    Answers Ollama's /api/chat with a canned reply, one word per streamed chunk,
+    so AnswerGenerator can be exercised without a real model.
+    """
+
+    answer = DEFAULT_ANSWER
+    token_delay = 0.02  # Seconds between streamed chunks
+    load_delay = 0.0  # Seconds before the first chunk, like a model load
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.end_headers()
+        self.wfile.write(b"Ollama is running")
+
+    def do_POST(self):
+        if self.path != "/api/chat":
+            self.send_error(404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        model = request.get("model", "stub")
+        tokens = [word + " " for word in self.answer.split()] if request.get("messages") else []
+        started = time.perf_counter_ns()
+        time.sleep(self.load_delay)
+
+        if not request.get("stream", True):
+            self.send_json(self.chunk(model, "".join(tokens), done=False)
+                           | self.final(model, len(tokens), started))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for token in tokens:
+            self.write_line(self.chunk(model, token, done=False))
+            time.sleep(self.token_delay)
+        self.write_line(self.chunk(model, "", done=True) | self.final(model, len(tokens), started))
+
+    @staticmethod
+    def chunk(model, content, done) -> dict:
+        return {"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "message": {"role": "assistant", "content": content}, "done": done}
+
+    @staticmethod
+    def final(model, token_count, started) -> dict:
+        elapsed = time.perf_counter_ns() - started
+        return {"done": True, "done_reason": "stop", "total_duration": elapsed,
+                "eval_count": token_count, "eval_duration": elapsed}
+
+    def write_line(self, payload: dict):
+        self.wfile.write(json.dumps(payload).encode() + b"\n")
+        self.wfile.flush()
+
+    def send_json(self, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep test output quiet
+
+
+def serve(port=11435, token_delay=0.02, load_delay=0.0) -> ThreadingHTTPServer:
+    """Start the stub on localhost:port; call serve_forever() on the result, or run it in a thread."""
+    StubChatHandler.token_delay = token_delay
+    StubChatHandler.load_delay = load_delay
+    return ThreadingHTTPServer(("127.0.0.1", port), StubChatHandler)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Stub Ollama chat server for exercising AnswerGenerator")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--load-delay", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = serve(args.port, args.token_delay, args.load_delay)
+    print(f"Stub Ollama listening on http://127.0.0.1:{args.port}")
+    server.serve_forever()